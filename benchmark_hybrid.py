@@ -0,0 +1,105 @@
+import os
+import time
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from utils.documents import load_md_files, split_documents, calculate_chunk_ids
+from utils.openapis import load_yaml_files
+from utils.embeddings import get_embeddings
+from utils.lexical import LexicalIndex, document_key, reciprocal_rank_fusion
+from utils.vectors import similarity_scores, top_k
+from evaluate_retrieval import load_queries
+
+"""
+Offline benchmark of lexical, vector and hybrid ranking.
+For every query it compares:
+- vector: embed the query and search an in-memory brute-force index
+- bm25: the lexical index only
+- hybrid: reciprocal rank fusion of vector and bm25
+- routed: exact endpoint/operationId lookups answered by the lexical index without embedding the query, hybrid otherwise
+and reports recall@k and MRR of the expected sources, the latency (query embedding included) and how many queries skipped the embedding.
+"""
+
+METHODS = ["vector", "bm25", "hybrid", "routed"]
+
+
+def main():
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description="Benchmark lexical, vector and hybrid ranking offline")
+    parser.add_argument("--openapi_dir_location", type=str, help="The location of the OpenAPI specs to load")
+    parser.add_argument("--repo_location", type=str, help="The location of the markdown repo to load")
+    parser.add_argument("--directories", type=str, help="Comma separated markdown directories to load")
+    parser.add_argument("--chunk_size", type=int, default=3000, help="The size of the markdown chunks")
+    parser.add_argument("--queries_file", type=str, required=True, help="JSONL file of {\"query\", \"expected_sources\"}")
+    parser.add_argument("--k", type=int, default=5, help="Recall@k")
+    parser.add_argument("--fake_embeddings", action="store_true", help="Use fake embeddings (no OpenAI calls)")
+    parser.add_argument("--cache_dir", type=str, default="~/.cache/rag-loader/embeddings", help="Where the OpenAI embeddings are cached")
+    args = parser.parse_args()
+
+    documents = []
+    if args.openapi_dir_location:
+        documents.extend(load_yaml_files(os.path.expanduser(args.openapi_dir_location)) or [])
+    if args.repo_location and args.directories:
+        md_documents = []
+        for directory in args.directories.split(","):
+            md_documents.extend(load_md_files(os.path.expanduser(args.repo_location), directory.strip()))
+        documents.extend(calculate_chunk_ids(split_documents(args.chunk_size, md_documents)))
+    if not documents:
+        parser.error("nothing to load, use --openapi_dir_location and/or --repo_location with --directories")
+    try:
+        queries = load_queries(os.path.expanduser(args.queries_file))
+    except ValueError as e:
+        parser.error(str(e))
+
+    lexical_index = LexicalIndex()
+    lexical_index.add_documents(documents)
+    keys = [document_key(doc) for doc in documents]
+    source_of = {key: doc.metadata["source"] for key, doc in zip(keys, documents)}
+
+    embeddings = get_embeddings(os.getenv("OPENAI_API_KEY"), fake=args.fake_embeddings,
+                                cache_dir=None if args.fake_embeddings else os.path.expanduser(args.cache_dir))
+    corpus = np.array(embeddings.embed_documents([doc.page_content for doc in documents]), dtype=np.float32)
+
+    def vector_ranking(query):
+        query_vector = np.array(embeddings.embed_query(query), dtype=np.float32)
+        return [keys[i] for i in top_k(similarity_scores(corpus, query_vector[None, :], "float"), args.k * 4)[0]]
+
+    def bm25_ranking(query):
+        return [key for key, _ in lexical_index.search(query, args.k * 4)]
+
+    def rank(method, query):
+        """
+        :return: the ranked keys and whether the query was embedded
+        """
+        if method == "vector":
+            return vector_ranking(query), True
+        if method == "bm25":
+            return bm25_ranking(query), False
+        if method == "routed":
+            exact = lexical_index.exact_lookup(query)
+            if exact:
+                return exact, False
+        return reciprocal_rank_fusion([vector_ranking(query), bm25_ranking(query)]), True
+
+    print(f"\n{len(documents)} documents, {len(queries)} queries")
+    print(f"{'method':>8} {'recall@' + str(args.k):>9} {'mrr':>6} {'mean ms':>8} {'p95 ms':>7} {'embedded':>9}")
+    for method in METHODS:
+        recalls, reciprocal_ranks, latencies, embedded = [], [], [], 0
+        for query in queries:
+            start = time.perf_counter()
+            ranking, was_embedded = rank(method, query["query"])
+            latencies.append((time.perf_counter() - start) * 1000)
+            embedded += was_embedded
+
+            # several chunks can come from the same source, rank the sources
+            sources = list(dict.fromkeys(source_of[key] for key in ranking))[:args.k]
+            recalls.append(len(set(sources) & query["expected_sources"]) / len(query["expected_sources"]))
+            first_hit = next((i for i, source in enumerate(sources) if source in query["expected_sources"]), None)
+            reciprocal_ranks.append(0 if first_hit is None else 1 / (first_hit + 1))
+        print(f"{method:>8} {np.mean(recalls):>9.3f} {np.mean(reciprocal_ranks):>6.3f} {np.mean(latencies):>8.2f} "
+              f"{np.percentile(latencies, 95):>7.2f} {embedded:>4}/{len(queries):<4}")
+
+
+if __name__ == "__main__":
+    main()
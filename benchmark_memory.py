@@ -0,0 +1,149 @@
+import os
+import time
+import argparse
+import resource
+import tracemalloc
+import multiprocessing
+from langchain_core.documents import Document
+
+"""
+Memory benchmark of the load -> split -> diff stages of populate_db.py:
+- documents: LangChain Documents (load_md_files, split_documents, calculate_chunk_ids, compare_records)
+- records: compact chunk records (load_md_records, split_records, compare_chunk_records)
+Every path runs in its own process so its max RSS can be measured. The existing state of the collection
+is simulated, as if it was read back from MongoDB (i.e. with its own copies of the strings).
+"""
+
+
+def _copy(value):
+    # a new string object, like the ones decoded from a MongoDB result
+    return (value + ".")[:-1] if value else value
+
+
+def compare_records(chunks_with_ids: list[Document], existing_items_dict: dict):
+    """
+    Track new/updated documents (chunks) and documents to delete,
+    the diff populate_db.py did before the chunk records (kept here as the baseline)
+    """
+    new_chunks = []
+    to_delete_chunks = []
+    
+    # Group existing items by source
+    source_to_existing = {}
+    for item_id, item_data in existing_items_dict.items():
+        source = item_data["source"]
+        if source not in source_to_existing:
+            source_to_existing[source] = []
+        source_to_existing[source].append({
+            "id": item_id,
+            "last_commit_date": item_data["last_commit_date"]
+        })
+    print(f"source_to_existing has {len(source_to_existing)} sources")
+    #print(f"source_to_existing: {source_to_existing}")
+    
+    # Process each chunk
+    for chunk in chunks_with_ids:
+        chunk_source = chunk.metadata["source"]
+        chunk_date = chunk.metadata["last_commit_date"]
+        
+        if chunk_source in source_to_existing:
+            # Source exists - check dates
+            # Get the last commit date from the first item in the array
+            # (assuming all items for the same source have the same date)
+            existing_date = source_to_existing[chunk_source][0]["last_commit_date"]
+            
+            if chunk_date > existing_date:
+                print(f"UPDATING: md file {chunk_source} date: {chunk_date} is more recent")
+                # Add to new chunks and mark existing ones for deletion
+                new_chunks.append(chunk)
+                print(f"to_delete_chunks: {chunk.metadata['id']}")
+                to_delete_chunks.append(chunk.metadata["id"])
+            
+        else:
+            # Completely new source
+            new_chunks.append(chunk)
+    
+    return to_delete_chunks, new_chunks
+
+
+def _run_documents(repo_path, directories, chunk_size, existing):
+    from utils.documents import load_md_files, split_documents, calculate_chunk_ids
+
+    chunks = []
+    for directory in directories:
+        chunks.extend(calculate_chunk_ids(split_documents(chunk_size, load_md_files(repo_path, directory))))
+    existing_items_dict = {}
+    if existing != "none":
+        for chunk in chunks:
+            date = chunk.metadata["last_commit_date"] if existing == "same" else ""
+            existing_items_dict[_copy(chunk.metadata["id"])] = {"last_commit_date": _copy(date),
+                                                                 "source": _copy(chunk.metadata["source"])}
+    to_delete, new_chunks = compare_records(chunks, existing_items_dict)
+    return chunks, existing_items_dict, to_delete, new_chunks
+
+
+def _run_records(repo_path, directories, chunk_size, existing):
+    from utils.documents import find_md_sources
+    from utils.chunks import load_md_records, split_records, compare_chunk_records
+
+    chunks = []
+    for directory in directories:
+        sources = find_md_sources(repo_path, directory)
+        files = load_md_records(repo_path, sources, git_search_path=os.path.join(repo_path, directory))
+        chunks.extend(split_records(chunk_size, files))
+    existing_dates = {}
+    if existing != "none":
+        for chunk in chunks:
+            existing_dates.setdefault(chunk.source, _copy(chunk.last_commit_date if existing == "same" else ""))
+    to_delete, new_chunks = compare_chunk_records(chunks, existing_dates)
+    return chunks, existing_dates, to_delete, new_chunks
+
+
+def _measure(path, repo_path, directories, chunk_size, existing):
+    run = _run_documents if path == "documents" else _run_records
+    # import everything first, so that only the data is measured
+    import utils.documents
+    import utils.chunks
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = run(repo_path, directories, chunk_size, existing)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "path": path,
+        "chunks": len(result[0]),
+        "new": len(result[3]),
+        "retained_mb": retained / 2**20,
+        "peak_mb": peak / 2**20,
+        # KB on Linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory used by the Document and the chunk record paths")
+    parser.add_argument("--repo_location", type=str, required=True, help="The location of the repo to load")
+    parser.add_argument("--directories", type=str, required=True, help="Comma separated directories to load")
+    parser.add_argument("--chunk_size", type=int, default=3000, help="The size of the chunks")
+    parser.add_argument("--existing", type=str, default="same", choices=["none", "same", "older"],
+                        help="Simulated collection: empty, up to date, or with older dates (everything is updated)")
+    args = parser.parse_args()
+
+    repo_path = os.path.expanduser(args.repo_location)
+    directories = [directory.strip() for directory in args.directories.split(",")]
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for path in ["documents", "records"]:
+        with context.Pool(1) as pool:
+            rows.append(pool.apply(_measure, (path, repo_path, directories, args.chunk_size, args.existing)))
+
+    print(f"\n{'path':>10} {'chunks':>7} {'new':>7} {'retained MB':>12} {'peak MB':>8} {'max RSS MB':>11} {'seconds':>8}")
+    for row in rows:
+        print(f"{row['path']:>10} {row['chunks']:>7} {row['new']:>7} {row['retained_mb']:>12.1f} {row['peak_mb']:>8.1f} "
+              f"{row['max_rss_mb']:>11.1f} {row['seconds']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import argparse
+import itertools
+import numpy as np
+import tiktoken
+from dotenv import load_dotenv
+from utils.documents import load_md_files, split_documents, calculate_chunk_ids, SPLITTER_MODES
+from utils.embeddings import get_embeddings, EMBEDDING_DIMENSIONS, EMBEDDING_MODEL
+from utils.vectors import truncate_embeddings, similarity_scores, top_k
+
+"""
+Offline evaluation of the chunking and embedding settings.
+The markdown files are loaded once, then for every config (chunk size, overlap, splitter mode, dimensions)
+they are split with the same splitter used by populate_db.py and searched with an in-memory brute-force index.
+For every config it reports recall@k of the expected sources, the size of the results and the search latency.
+Use --fake_embeddings or a filled --cache_dir to run it without OpenAI calls.
+"""
+
+def load_queries(file_path):
+    """
+    Load the queries from a JSONL file, one {"query": "...", "expected_sources": ["docs/..."]} per line
+    """
+    queries = []
+    with open(file_path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                item = json.loads(line)
+                if not item.get("expected_sources"):
+                    raise ValueError(f"{file_path}:{line_number}: the query has no expected_sources")
+                queries.append({"query": item["query"], "expected_sources": set(item["expected_sources"])})
+    return queries
+
+
+def get_token_counter():
+    """
+    Count tokens with the tiktoken encoding of the embedding model. tiktoken downloads the encoding
+    the first time it is used, when it can't be loaded (offline) the tokens are estimated from the characters.
+    """
+    try:
+        encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+    except Exception as e:
+        print(f"⚠️ Could not load the tiktoken encoding ({e}), estimating tokens as characters / 4")
+        return lambda text: len(text) // 4
+    return lambda text: len(encoding.encode(text))
+
+
+def evaluate_config(chunks, chunk_vectors, query_vectors, queries, dimensions, k, count_tokens):
+    """
+    Search every query in the chunks and measure recall@k, result size and latency
+    """
+    corpus = truncate_embeddings(chunk_vectors, dimensions)
+    query_matrix = truncate_embeddings(query_vectors, dimensions)
+
+    recalls, tokens_per_result, characters, latencies = [], [], [], []
+    for query, query_vector in zip(queries, query_matrix):
+        start = time.perf_counter()
+        result_ids = top_k(similarity_scores(corpus, query_vector[None, :], "float"), k)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        results = [chunks[i] for i in result_ids]
+        found = {chunk.metadata["source"] for chunk in results} & query["expected_sources"]
+        recalls.append(len(found) / len(query["expected_sources"]))
+        # a config can have fewer than k chunks
+        tokens_per_result.append(sum(count_tokens(chunk.page_content) for chunk in results) / len(results))
+        characters.append(sum(len(chunk.page_content) for chunk in results))
+
+    return {
+        "chunks": len(chunks),
+        "recall": float(np.mean(recalls)),
+        "tokens_per_result": float(np.mean(tokens_per_result)),
+        "chars_per_query": float(np.mean(characters)),
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency of chunking and embedding settings")
+    parser.add_argument("--repo_location", type=str, required=True, help="The location of the repo to load")
+    parser.add_argument("--directories", type=str, required=True, help="Comma separated directories to load, e.g. docs/commerce-manager,guides")
+    parser.add_argument("--queries_file", type=str, required=True, help="JSONL file of {\"query\", \"expected_sources\"}")
+    parser.add_argument("--chunk_sizes", type=str, default="1000,2000,3000", help="Comma separated chunk sizes")
+    parser.add_argument("--chunk_overlaps", type=str, default="0.1", help="Comma separated overlaps, as a fraction of the chunk size")
+    parser.add_argument("--splitters", type=str, default="recursive", help=f"Comma separated splitter modes: {', '.join(SPLITTER_MODES)}")
+    parser.add_argument("--dimensions", type=str, default=str(EMBEDDING_DIMENSIONS), help="Comma separated embedding dimensions")
+    parser.add_argument("--k", type=int, default=5, help="Recall@k")
+    parser.add_argument("--fake_embeddings", action="store_true", help="Use fake embeddings (no OpenAI calls)")
+    parser.add_argument("--cache_dir", type=str, default="~/.cache/rag-loader/embeddings", help="Where the OpenAI embeddings are cached")
+    parser.add_argument("--output", type=str, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    chunk_sizes = [int(v) for v in args.chunk_sizes.split(",")]
+    chunk_overlaps = [float(v) for v in args.chunk_overlaps.split(",")]
+    splitters = [v.strip() for v in args.splitters.split(",")]
+    dimensions_list = [int(v) for v in args.dimensions.split(",")]
+    if any(dimensions < 1 or dimensions > EMBEDDING_DIMENSIONS for dimensions in dimensions_list):
+        parser.error(f"--dimensions must be between 1 and {EMBEDDING_DIMENSIONS}")
+
+    repo_path = os.path.expanduser(args.repo_location)
+    try:
+        queries = load_queries(os.path.expanduser(args.queries_file))
+    except ValueError as e:
+        parser.error(str(e))
+    documents = []
+    for directory in args.directories.split(","):
+        documents.extend(load_md_files(repo_path, directory.strip()))
+
+    # embed at full size once per chunking config, smaller dimensions are derived by truncation
+    embeddings = get_embeddings(os.getenv("OPENAI_API_KEY"), fake=args.fake_embeddings,
+                                cache_dir=None if args.fake_embeddings else os.path.expanduser(args.cache_dir))
+    query_vectors = np.array(embeddings.embed_documents([q["query"] for q in queries]), dtype=np.float32)
+    count_tokens = get_token_counter()
+
+    rows = []
+    for chunk_size, chunk_overlap, splitter in itertools.product(chunk_sizes, chunk_overlaps, splitters):
+        chunks = calculate_chunk_ids(split_documents(chunk_size, documents, chunk_overlap, splitter))
+        chunk_vectors = np.array(embeddings.embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32)
+        for dimensions in dimensions_list:
+            row = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "splitter": splitter, "dimensions": dimensions}
+            row.update(evaluate_config(chunks, chunk_vectors, query_vectors, queries, dimensions, args.k,
+                                       count_tokens))
+            rows.append(row)
+
+    print(f"\n{'size':>6} {'overlap':>7} {'splitter':>9} {'dims':>5} {'chunks':>7} {'recall@' + str(args.k):>9} "
+          f"{'tok/result':>10} {'chars/query':>11} {'p50 ms':>7} {'p95 ms':>7}")
+    for row in rows:
+        print(f"{row['chunk_size']:>6} {row['chunk_overlap']:>7.2f} {row['splitter']:>9} {row['dimensions']:>5} "
+              f"{row['chunks']:>7} {row['recall']:>9.3f} {row['tokens_per_result']:>10.0f} "
+              f"{row['chars_per_query']:>11.0f} {row['latency_p50_ms']:>7.2f} {row['latency_p95_ms']:>7.2f}")
+
+    if args.output:
+        with open(os.path.expanduser(args.output), "w") as f:
+            json.dump(rows, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
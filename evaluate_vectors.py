@@ -0,0 +1,101 @@
+import os
+import json
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from utils.vectors import truncate_embeddings, encode_vectors, similarity_scores, top_k, recall_at_k, vector_bytes
+
+"""
+Offline recall evaluation of reduced-dimension and quantized embeddings.
+The full float embeddings already stored (in MongoDB or in a JSONL file) are the ground truth:
+a sample of them is used as queries and the top k neighbours found with each
+dimensions/format combination are compared with the ones found with the full vectors.
+No OpenAI calls are made: shortened text-embedding-3 embeddings are the truncated, re-normalized full vectors.
+"""
+
+def load_embeddings_from_mongo(collection_name, limit):
+    client = MongoClient(os.getenv("MONGODB_ATLAS_CLUSTER_URI"))
+    collection = client[os.getenv("DB_NAME")][collection_name]
+    pipeline = [{"$match": {"embedding": {"$exists": True}}}, {"$project": {"_id": 0, "embedding": 1}}]
+    if limit:
+        pipeline.insert(1, {"$sample": {"size": limit}})
+    return np.array([item["embedding"] for item in collection.aggregate(pipeline)], dtype=np.float32)
+
+
+def load_embeddings_from_file(file_path, limit):
+    """
+    Load embeddings from a JSONL file, one {"embedding": [...]} per line
+    """
+    embeddings = []
+    with open(file_path, "r") as f:
+        for line in f:
+            if line.strip():
+                embeddings.append(json.loads(line)["embedding"])
+            if limit and len(embeddings) >= limit:
+                break
+    return np.array(embeddings, dtype=np.float32)
+
+
+def evaluate(corpus, num_queries, k, dimensions_list, formats, seed=0):
+    """
+    :return: a list of rows with dimensions, format, bytes per vector and recall@k
+    """
+    rng = np.random.default_rng(seed)
+    query_ids = rng.choice(len(corpus), size=min(num_queries, len(corpus)), replace=False)
+
+    def neighbours(scores):
+        # a query is part of the corpus, never count it as its own neighbour
+        scores[np.arange(len(query_ids)), query_ids] = -np.inf
+        return top_k(scores, k)
+
+    expected = neighbours(similarity_scores(corpus, corpus[query_ids], "float"))
+
+    rows = []
+    for dimensions in dimensions_list:
+        reduced = truncate_embeddings(corpus, dimensions)
+        for vector_format in formats:
+            encoded = encode_vectors(reduced, vector_format)
+            retrieved = neighbours(similarity_scores(encoded, encoded[query_ids], vector_format))
+            rows.append({
+                "dimensions": dimensions,
+                "format": vector_format,
+                "bytes": vector_bytes(dimensions, vector_format),
+                "recall": recall_at_k(retrieved, expected),
+            })
+    return rows
+
+
+def main():
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description="Evaluate the recall of reduced-dimension and quantized embeddings")
+    parser.add_argument("--collection", type=str, help="The collection with the full float embeddings")
+    parser.add_argument("--embeddings_file", type=str, help="A JSONL file with the full float embeddings, instead of a collection")
+    parser.add_argument("--limit", type=int, default=10000, help="Max number of embeddings to load (0 for all)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of embeddings used as queries")
+    parser.add_argument("--k", type=int, default=10, help="Recall@k")
+    parser.add_argument("--dimensions", type=str, default="256,512,1024,1536", help="Comma separated dimensions to evaluate")
+    parser.add_argument("--vector_formats", type=str, default="float,int8,binary", help="Comma separated formats to evaluate")
+    args = parser.parse_args()
+
+    if bool(args.collection) == bool(args.embeddings_file):
+        parser.error("use either --collection or --embeddings_file")
+
+    if args.embeddings_file:
+        corpus = load_embeddings_from_file(os.path.expanduser(args.embeddings_file), args.limit)
+    else:
+        corpus = load_embeddings_from_mongo(args.collection, args.limit)
+    print(f"Loaded {len(corpus)} embeddings of {corpus.shape[1]} dimensions")
+
+    dimensions_list = [int(d) for d in args.dimensions.split(",") if int(d) <= corpus.shape[1]]
+    formats = [f.strip() for f in args.vector_formats.split(",")]
+    rows = evaluate(corpus, args.queries, args.k, dimensions_list, formats)
+
+    print(f"\n{'dimensions':>10} {'format':>8} {'bytes':>7} {'recall@' + str(args.k):>10}")
+    for row in rows:
+        print(f"{row['dimensions']:>10} {row['format']:>8} {row['bytes']:>7} {row['recall']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,22 @@
 import os
 import argparse
+import time
+import traceback
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from langchain_core.documents import Document
-from langchain_openai import OpenAIEmbeddings
 from pymongo import MongoClient
 from langchain_mongodb import MongoDBAtlasVectorSearch
-from utils.documents import load_md_files, split_documents, calculate_chunk_ids
-# from utils.git import clone_repo, delete_repo
+from utils.documents import find_md_sources, SPLITTER_MODES
+from utils.chunks import (load_md_records, split_records, get_existing_dates, compare_chunk_records,
+                          RecordDocuments, ChunkRecord)
+from utils.embeddings import get_embeddings, EMBEDDING_DIMENSIONS
+from utils.mongo import (upsert_documents, parse_vector_formats, ensure_indexes, wait_for_search_index,
+                         EMBEDDING_FIELDS, VECTOR_INDEX_NAME)
+from utils.lexical import update_lexical_index, build_lexical_index, build_lexical_index_from_collection
+from utils.generations import resolve_collection_name, rebuild_collection, rollback, CUTOVER_MODES
+from utils.jobs import (plan_work_units, create_job, lease_work_unit, complete_work_unit, fail_work_unit,
+                        reap_expired_leases, job_status, default_worker_id, LeaseHeartbeat, LeaseLostError)
+from utils.git import sync_repo
 
 # Global variable declarations
 OPENAI_API_KEY = None
@@ -14,130 +24,274 @@ MONGODB_ATLAS_CLUSTER_URI = None
 DB_NAME = None
 DOC_SITE = None
 COLLECTION_NAME = None
+JOBS_COLLECTION_NAME = None
+FAKE_EMBEDDINGS = False
+DIMENSIONS = EMBEDDING_DIMENSIONS
+VECTOR_FORMATS = ["float"]
+LEXICAL_INDEX_PATH = None
 
 """
-This function takes a list of documents with IDs and adds them to a vector database
-IF the document has a newer last_commit_date than the one in the DB, it will update the document.
+This function takes a list of chunk records and adds them to a vector database
+IF the chunk has a newer last_commit_date than the one in the DB, it will update the document.
 Otherwise, it will skip the document.
+The Documents are only built for the new/updated chunks.
+With replace_all, the documents of `sources` are all deleted and written again whatever their date
+(e.g. to repair a work unit a previous worker left half written).
+With a lease (distributed workers), nothing more is written once the lease is lost.
 """
-def add_to_vectorDB(chunks_with_ids: list[Document]):
-    atlas_collection, db = connectToMongo()
+def add_to_vectorDB(chunk_records: list[ChunkRecord], sources: list[str] = None, lease: LeaseHeartbeat = None,
+                    connection=None, replace_all=False):
+    atlas_collection, db = connection or connectToMongo()
     
-    existing_items_dict = get_existing_items(atlas_collection)  
-    
-    to_delete_chunks, new_chunks = compare_records(chunks_with_ids, existing_items_dict)
+    if replace_all:
+        to_delete_chunks = atlas_collection.distinct("id", {"source": {"$in": sources}})
+        new_records = chunk_records
+    else:
+        existing_dates = get_existing_dates(atlas_collection, sources)
+        to_delete_chunks, new_records = compare_chunk_records(chunk_records, existing_dates)
+    new_chunks = RecordDocuments(new_records)
+    if lease:
+        lease.check()
     
     # Handle deletions if any
     if len(to_delete_chunks):
         print(f"🗑️ Deleting outdated documents: {len(to_delete_chunks)}")
         # print(f"to_delete_chunks: {to_delete_chunks}")
-        atlas_collection.delete_many({"id": {"$in": to_delete_chunks}})
+        if replace_all:
+            atlas_collection.delete_many({"source": {"$in": sources}})
+        else:
+            atlas_collection.delete_many({"id": {"$in": to_delete_chunks}})
     else:
         print("✅ No documents to delete")
     
     # Handle additions if any
     if len(new_chunks):
         print(f"👉 Adding new/updated documents: {len(new_chunks)}")
-        new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
+        new_chunk_ids = [record.id for record in new_records]
         #print(f"new_chunk_ids: {new_chunk_ids}")
-        db.add_documents(new_chunks, ids=new_chunk_ids)
+        upsert_documents(atlas_collection, db.embeddings, new_chunks, ids=new_chunk_ids, vector_formats=VECTOR_FORMATS,
+                         before_write=lease.check if lease else None)
         #print(f"chunks added: {new_chunks}")
     else:
         print("✅ No new documents to add")
-        
-    return
-
-def get_existing_items(atlas_collection):
-    """
-    Get id, last_commit_date, and source for all existing documents
-    """
-    existing_items = atlas_collection.find({}, {"_id": 0, "id": 1, "last_commit_date": 1, "source": 1})
-    existing_items = list(existing_items)
     
-    # Create dictionaries for existing items
-    existing_items_dict = {item["id"]: {"last_commit_date": item["last_commit_date"], "source": item["source"]} 
-                            for item in existing_items}
-    return existing_items_dict
-
-def compare_records(chunks_with_ids: list[Document], existing_items_dict: dict):
-    """
-    Track new/updated documents (chunks) and documents to delete
-    """
-    new_chunks = []
-    to_delete_chunks = []
-    
-    # Group existing items by source
-    source_to_existing = {}
-    for item_id, item_data in existing_items_dict.items():
-        source = item_data["source"]
-        if source not in source_to_existing:
-            source_to_existing[source] = []
-        source_to_existing[source].append({
-            "id": item_id,
-            "last_commit_date": item_data["last_commit_date"]
-        })
-    print(f"source_to_existing has {len(source_to_existing)} sources")
-    #print(f"source_to_existing: {source_to_existing}")
-    
-    # Process each chunk
-    for chunk in chunks_with_ids:
-        chunk_source = chunk.metadata["source"]
-        chunk_date = chunk.metadata["last_commit_date"]
+    if LEXICAL_INDEX_PATH:
+        update_lexical_index(LEXICAL_INDEX_PATH, atlas_collection, to_delete_chunks, new_chunks)
         
-        if chunk_source in source_to_existing:
-            # Source exists - check dates
-            # Get the last commit date from the first item in the array
-            # (assuming all items for the same source have the same date)
-            existing_date = source_to_existing[chunk_source][0]["last_commit_date"]
-            
-            if chunk_date > existing_date:
-                print(f"UPDATING: md file {chunk_source} date: {chunk_date} is more recent")
-                # Add to new chunks and mark existing ones for deletion
-                new_chunks.append(chunk)
-                print(f"to_delete_chunks: {chunk.metadata['id']}")
-                to_delete_chunks.append(chunk.metadata["id"])
-            
-        else:
-            # Completely new source
-            new_chunks.append(chunk)
-    
-    return to_delete_chunks, new_chunks
-    
+    return {"deleted": len(to_delete_chunks), "added": len(new_chunks)}
+
 def connectToMongo():
     
     print("🔗 Connecting to MongoDB Atlas")
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, model="text-embedding-3-small") 
+    embeddings = get_embeddings(OPENAI_API_KEY, fake=FAKE_EMBEDDINGS, dimensions=DIMENSIONS)
     
     # Connect to your Atlas cluster
     client = MongoClient(MONGODB_ATLAS_CLUSTER_URI)
     db_name = DB_NAME 
-    collection_name = COLLECTION_NAME 
+    # the live generation if the collection was rebuilt with --rebuild --cutover pointer
+    collection_name = resolve_collection_name(client[db_name], COLLECTION_NAME)
     atlas_collection = client[db_name][collection_name]
-    vector_search_index = "vector_index"
+    vector_search_index = VECTOR_INDEX_NAME
 
     # Create a MongoDBAtlasVectorSearch object
     db = MongoDBAtlasVectorSearch.from_connection_string(
         MONGODB_ATLAS_CLUSTER_URI,
         db_name + "." + collection_name,
         embeddings, #OpenAIEmbeddings(disallowed_special=(), model="text-embedding-3-small") ,
-        index_name = vector_search_index
+        index_name = vector_search_index,
+        embedding_key = EMBEDDING_FIELDS[VECTOR_FORMATS[0]]
     )
     
     return atlas_collection,db
+
+def setup_indexes(skip_search_index):
+    """
+    :return: the collection, or None if its search index doesn't match --dimensions/--vector_formats
+    """
+    atlas_collection, _ = connectToMongo()
+    try:
+        ensure_indexes(atlas_collection, DIMENSIONS, VECTOR_FORMATS, search_index=not skip_search_index)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return None
+    return atlas_collection
+
+def run_rebuild(args, directories_to_load):
+    """
+    Load everything in a new generation of the collection and cut over to it once validated.
+    The rebuild replaces the whole collection: the cutover is refused if directories of the live collection
+    are missing from it (e.g. the other EPSM repo).
+    """
+    temp_repo_path = os.path.expanduser(args.repo_location)
+    chunk_records = []
+    for directory in directories_to_load:
+        print(f"Processing MD files from repo for {directory} directory")
+        sources = find_md_sources(temp_repo_path, directory)
+        files = load_md_records(temp_repo_path, sources, args.base_url if args.doc_site == "EPSM" else None,
+                                git_search_path=os.path.join(temp_repo_path, directory))
+        chunk_records.extend(split_records(args.chunk_size, files, args.chunk_overlap, args.splitter))
+    chunks_with_ids = RecordDocuments(chunk_records)
+    
+    client = MongoClient(MONGODB_ATLAS_CLUSTER_URI)
+    embeddings = get_embeddings(OPENAI_API_KEY, fake=FAKE_EMBEDDINGS, dimensions=DIMENSIONS)
+    is_live = rebuild_collection(
+        client[DB_NAME], COLLECTION_NAME, embeddings, chunks_with_ids, DIMENSIONS,
+        ids=[record.id for record in chunk_records],
+        vector_formats=VECTOR_FORMATS,
+        search_index=not args.skip_search_index,
+        cutover_mode=args.cutover,
+        keep_generations=args.keep_generations,
+        min_count_ratio=args.min_count_ratio,
+        allow_missing_directories=args.allow_missing_directories,
+    )
+    if is_live and LEXICAL_INDEX_PATH:
+        build_lexical_index(LEXICAL_INDEX_PATH, chunks_with_ids)
+    return is_live
+
+def connectToJobs():
+    client = MongoClient(MONGODB_ATLAS_CLUSTER_URI)
+    return client[DB_NAME][JOBS_COLLECTION_NAME]
+
+def process_sources(temp_repo_path, sources: list[str], base_url, chunk_size, chunk_overlap, splitter,
+                    lease: LeaseHeartbeat = None, connection=None, replace_all=False):
+    """
+    Load, split, embed and upsert a list of sources
+    """
+    files = load_md_records(temp_repo_path, sources, base_url)
+    chunk_records = split_records(chunk_size, files, chunk_overlap, splitter)
+    return add_to_vectorDB(chunk_records, sources, lease, connection, replace_all)
+
+def run_coordinator(args, directories_to_load):
+    """
+    Partition the sources (by hash of `source`) into work units stored in the jobs collection
+    """
+    temp_repo_path = os.path.expanduser(args.repo_location)
+    job_id = args.job_id or f"{args.doc_site}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}"
+    sources_by_directory = {directory: find_md_sources(temp_repo_path, directory) 
+                            for directory in directories_to_load}
+    units = plan_work_units(sources_by_directory, args.num_partitions)
+    jobs_collection = connectToJobs()
+    create_job(jobs_collection, job_id, units, 
+               {"doc_site": args.doc_site, "base_url": args.base_url if args.doc_site == "EPSM" else None,
+                "chunk_size": args.chunk_size,
+                "chunk_overlap": args.chunk_overlap, "splitter": args.splitter,
+                "dimensions": DIMENSIONS, "vector_formats": VECTOR_FORMATS})
+    print(f"📋 Job {job_id}: {len(units)} work units in {JOBS_COLLECTION_NAME}")
+    print(f"Start workers with: --mode worker --job_id {job_id}")
+    print(f"Status: {job_status(jobs_collection, job_id)}")
+
+def run_worker(args):
+    """
+    Lease work units of a job until all of them are done or failed.
+    Units whose lease expired (e.g. a worker died) are leased again.
+    """
+    temp_repo_path = os.path.expanduser(args.repo_location)
+    worker_id = args.worker_id or default_worker_id()
+    jobs_collection = connectToJobs()
+    print(f"👷 Worker {worker_id} processing job {args.job_id}")
+    # the coordinator checked the search index against its own settings, the embeddings must match them
+    # and the units must be written in the collection of the same doc site
+    job = jobs_collection.find_one({"job_id": args.job_id}, {"doc_site": 1, "dimensions": 1, "vector_formats": 1})
+    if job is None:
+        print(f"❌ Job {args.job_id} not found in {JOBS_COLLECTION_NAME}")
+        return
+    if (job.get("doc_site", args.doc_site) != args.doc_site or job.get("dimensions", DIMENSIONS) != DIMENSIONS
+            or job.get("vector_formats", VECTOR_FORMATS) != VECTOR_FORMATS):
+        print(f"❌ Job {args.job_id} uses --doc_site {job.get('doc_site')} --dimensions {job.get('dimensions')} "
+              f"--vector_formats {','.join(job.get('vector_formats', []))}, start the worker with the same settings")
+        return
+    # one connection for all the units of this worker
+    connection = connectToMongo()
+    
+    while True:
+        unit = lease_work_unit(jobs_collection, args.job_id, worker_id, args.lease_seconds, args.max_attempts)
+        if unit is None:
+            reap_expired_leases(jobs_collection, args.job_id, args.max_attempts)
+            status = job_status(jobs_collection, args.job_id)
+            if status["pending"] == 0 and status["leased"] == 0:
+                print(f"✅ Job {args.job_id} finished: {status}")
+                return
+            # other workers hold the remaining leases, wait in case one of them expires
+            time.sleep(args.poll_seconds)
+            continue
+        
+        print(f"🔒 Leased {unit['_id']} ({len(unit['sources'])} sources, attempt {unit['attempts']})")
+        try:
+            with LeaseHeartbeat(jobs_collection, unit["_id"], worker_id, args.lease_seconds) as lease:
+                # a previous attempt may have died between two batches, leaving a source half written
+                # with its new date: the date diff would skip it, so redo the whole unit
+                stats = process_sources(temp_repo_path, unit["sources"], unit["base_url"], unit["chunk_size"],
+                                        unit["chunk_overlap"], unit["splitter"], lease, connection,
+                                        replace_all=unit["attempts"] > 1)
+        except LeaseLostError as e:
+            # the unit belongs to another worker now, leave it alone
+            print(f"⚠️ {e}, skipping {unit['_id']}")
+            continue
+        except Exception as e:
+            traceback.print_exc()
+            fail_work_unit(jobs_collection, unit["_id"], worker_id, e, args.max_attempts)
+            print(f"❌ Failed {unit['_id']}: {e}")
+            continue
+        if complete_work_unit(jobs_collection, unit["_id"], worker_id, stats):
+            print(f"✅ Completed {unit['_id']}")
+        else:
+            print(f"⚠️ Lease on {unit['_id']} was lost before completion, another worker will redo it")
         
 
 def main():
-    global OPENAI_API_KEY, MONGODB_ATLAS_CLUSTER_URI, DB_NAME, DOC_SITE, COLLECTION_NAME
+    global OPENAI_API_KEY, MONGODB_ATLAS_CLUSTER_URI, DB_NAME, DOC_SITE, COLLECTION_NAME, JOBS_COLLECTION_NAME, FAKE_EMBEDDINGS
+    global DIMENSIONS, VECTOR_FORMATS, LEXICAL_INDEX_PATH
     
     load_dotenv(override=True)
     
     parser = argparse.ArgumentParser(description="Load MD files from Elastic Path Docs site in a MongoDB Atlas Cluster")
     parser.add_argument("--doc_site", type=str, required=True, help="The name of the docs site, EPCC or EPSM")
-    parser.add_argument("--repo_location", type=str, required=True, help="The location of the repo to load")
+    parser.add_argument("--repo_location", type=str, help="The location of the repo to load")
+    parser.add_argument("--repo_url", type=str, help="Sync --repo_location from this git url first (sparse checkout of the loaded directories)")
+    parser.add_argument("--branch", type=str, help="The branch to sync, defaults to the remote default branch")
     parser.add_argument("--base_url", type=str, required=False, help="The url of the documentation site")
     parser.add_argument("--chunk_size", type=int, default=3000, help="The size of the chunks")
+    parser.add_argument("--chunk_overlap", type=float, default=0.1, help="The overlap between chunks, as a fraction of the chunk size")
+    parser.add_argument("--splitter", type=str, default="recursive", choices=SPLITTER_MODES, help="How the documents are split")
+    parser.add_argument("--mode", type=str, default="single", choices=["single", "coordinator", "worker"], 
+                        help="single process, or distributed ingestion with a coordinator and several workers")
+    parser.add_argument("--job_id", type=str, help="The distributed ingestion job (required for workers)")
+    parser.add_argument("--num_partitions", type=int, default=16, help="Number of work units per directory (coordinator)")
+    parser.add_argument("--worker_id", type=str, help="The worker name, defaults to hostname:pid")
+    parser.add_argument("--lease_seconds", type=int, default=300, help="How long a work unit lease lasts without heartbeat")
+    parser.add_argument("--max_attempts", type=int, default=3, help="How many times a work unit is tried")
+    parser.add_argument("--poll_seconds", type=int, default=10, help="How long a worker waits when no work unit is available")
+    parser.add_argument("--fake_embeddings", action="store_true", help="Use fake embeddings, e.g. to test against a local mongod")
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS, help="The size of the embeddings (text-embedding-3-small supports shortened embeddings)")
+    parser.add_argument("--vector_formats", type=str, default="float", 
+                        help="Comma separated embedding storage formats: float, int8, binary (e.g. float,int8)")
+    parser.add_argument("--skip_search_index", action="store_true", help="Only create the regular indexes (e.g. on a local mongod)")
+    parser.add_argument("--wait_for_index", action="store_true", help="Wait for the vector search index to be ready after the load")
+    parser.add_argument("--lexical_index", type=str, help="Also maintain a lexical (BM25 + exact endpoint/operationId) index in this JSON file")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the whole collection in a new generation and cut over to it")
+    parser.add_argument("--cutover", type=str, default="pointer", choices=CUTOVER_MODES, help="How a rebuilt generation is made live")
+    parser.add_argument("--keep_generations", type=int, default=1, help="How many previous generations are kept for rollback")
+    parser.add_argument("--min_count_ratio", type=float, default=0.9, help="Min size of a rebuilt generation compared to the live one")
+    parser.add_argument("--allow_missing_directories", action="store_true",
+                        help="Cut over to a rebuild even if directories of the live collection have no sources in it")
+    parser.add_argument("--rollback", action="store_true", help="Make the previous generation live again")
     args = parser.parse_args()
     
+    if not args.repo_location and not args.rollback:
+        parser.error("--repo_location is required")
+    
+    try:
+        VECTOR_FORMATS = parse_vector_formats(args.vector_formats)
+    except ValueError as e:
+        parser.error(str(e))
+    DIMENSIONS = args.dimensions
+    LEXICAL_INDEX_PATH = args.lexical_index
+    
+    if args.mode == "worker" and not args.job_id:
+        parser.error("--job_id is required in worker mode")
+    if args.mode == "worker" and args.lexical_index:
+        parser.error("--lexical_index is a local file, it can't be maintained by distributed workers")
+    
     if args.doc_site == "EPCC":
         COLLECTION_NAME = os.getenv("COLLECTION_NAME_EPCC")
         print(f"Setting COLLECTION_NAME for EPCC: {COLLECTION_NAME}")
@@ -150,7 +304,7 @@ def main():
     elif args.doc_site == "EPSM":
         COLLECTION_NAME = os.getenv("COLLECTION_NAME_EPSM")
         print(f"Setting COLLECTION_NAME for EPSM: {COLLECTION_NAME}")
-        if args.repo_location.endswith("extension-framework"):
+        if (args.repo_location or "").endswith("extension-framework"):
             directories_to_load = ["website/versioned_docs/version-1.3.x"]
         else:
             directories_to_load = ["website/versioned_docs/version-8.6.x"]
@@ -170,28 +324,60 @@ def main():
     DB_NAME = os.getenv("DB_NAME")
     print(f"DB_NAME exists: {DB_NAME is not None}")
     
+    JOBS_COLLECTION_NAME = os.getenv("COLLECTION_NAME_JOBS", "ingest_jobs")
+    FAKE_EMBEDDINGS = args.fake_embeddings
+    
     print(f"COLLECTION_NAME: {COLLECTION_NAME}")
     print(f"COLLECTION_NAME exists: {COLLECTION_NAME is not None}")
 
     # Add error messages to assertions for better debugging
-    assert OPENAI_API_KEY is not None, f"OPENAI_API_KEY is not set in environment: {os.getenv('OPENAI_API_KEY')}"
+    assert OPENAI_API_KEY is not None or FAKE_EMBEDDINGS, f"OPENAI_API_KEY is not set in environment: {os.getenv('OPENAI_API_KEY')}"
     assert MONGODB_ATLAS_CLUSTER_URI is not None, f"MONGODB_ATLAS_CLUSTER_URI is not set in environment: {os.getenv('MONGODB_ATLAS_CLUSTER_URI')}"
     assert DB_NAME is not None, f"DB_NAME is not set in environment: {os.getenv('DB_NAME')}"
     assert COLLECTION_NAME is not None, f"COLLECTION_NAME is not set in environment. COLLECTION_NAME_EPCC: {os.getenv('COLLECTION_NAME_EPCC')}, COLLECTION_NAME_EPSM: {os.getenv('COLLECTION_NAME_EPSM')}"
     
 
+    if args.rollback:
+        client_db = MongoClient(MONGODB_ATLAS_CLUSTER_URI)[DB_NAME]
+        if rollback(client_db, COLLECTION_NAME):
+            if LEXICAL_INDEX_PATH:
+                live_collection = client_db[resolve_collection_name(client_db, COLLECTION_NAME)]
+                build_lexical_index_from_collection(LEXICAL_INDEX_PATH, live_collection)
+            else:
+                print(f"⚠️ A lexical index file of {COLLECTION_NAME} still matches the generation rolled back from: "
+                      "delete it, the next run with --lexical_index rebuilds it from the collection")
+        return
+    if args.repo_url and not sync_repo(args.repo_url, args.repo_location, directories_to_load, args.branch):
+        return
+    if args.rebuild:
+        run_rebuild(args, directories_to_load)
+        return
+    if args.mode == "coordinator":
+        if setup_indexes(args.skip_search_index) is None:
+            return
+        run_coordinator(args, directories_to_load)
+        return
+    if args.mode == "worker":
+        run_worker(args)
+        return
+
+    atlas_collection = setup_indexes(args.skip_search_index)
+    if atlas_collection is None:
+        return
     temp_repo_path = os.path.expanduser(args.repo_location)
     
     for directory in directories_to_load:
         print(f"Processing MD files from repo for {directory} directory")
-        if args.doc_site == "EPSM":
-            documents = load_md_files(temp_repo_path, directory, args.base_url)
-        else:
-            documents = load_md_files(temp_repo_path, directory)
-        chunks = split_documents(args.chunk_size, documents)
-        chunks_with_ids = calculate_chunk_ids(chunks)
-        add_to_vectorDB(chunks_with_ids)
+        sources = find_md_sources(temp_repo_path, directory)
+        files = load_md_records(temp_repo_path, sources, args.base_url if args.doc_site == "EPSM" else None,
+                                git_search_path=os.path.join(temp_repo_path, directory))
+        chunk_records = split_records(args.chunk_size, files, args.chunk_overlap, args.splitter)
+        # the files are no longer needed once they are split, only the chunks they share the text with
+        del files
+        add_to_vectorDB(chunk_records, sources)
     
+    if args.wait_for_index and not args.skip_search_index:
+        wait_for_search_index(atlas_collection)
 
 
 if __name__ == "__main__":
@@ -3,17 +3,24 @@ import yaml
 import os
 import argparse
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
 from pymongo import MongoClient
 from langchain_mongodb import MongoDBAtlasVectorSearch
 from utils.openapis import load_yaml_files
 from langchain.schema import Document
+from utils.lexical import update_lexical_index, build_lexical_index, build_lexical_index_from_collection
+from utils.generations import resolve_collection_name, rebuild_collection, rollback, CUTOVER_MODES
+from utils.embeddings import get_embeddings, EMBEDDING_DIMENSIONS
+from utils.mongo import (upsert_documents, parse_vector_formats, ensure_indexes, wait_for_search_index,
+                         EMBEDDING_FIELDS, VECTOR_INDEX_NAME)
 
 # Global variable declarations
 OPENAI_API_KEY = None
 MONGODB_ATLAS_CLUSTER_URI = None
 DB_NAME = None
 COLLECTION_NAME_OPENAPI = None
+DIMENSIONS = EMBEDDING_DIMENSIONS
+VECTOR_FORMATS = ["float"]
+LEXICAL_INDEX_PATH = None
 
 def add_to_vectorDB(documents: list[Document]):
     atlas_collection, db = connectToMongo()
@@ -28,10 +35,13 @@ def add_to_vectorDB(documents: list[Document]):
         
     if len(new_chunks):
         print(f"👉 Adding new/updated documents: {len(new_chunks)}")
-        db.add_documents(new_chunks)
+        upsert_documents(atlas_collection, db.embeddings, new_chunks, vector_formats=VECTOR_FORMATS)
     else:
         print("✅ No new documents to add")
     
+    if LEXICAL_INDEX_PATH:
+        update_lexical_index(LEXICAL_INDEX_PATH, atlas_collection, to_delete_chunks, new_chunks)
+    
     return
 
 def compare_records(documents: list[Document], existing_items_dict: dict):
@@ -64,24 +74,26 @@ def get_existing_items(atlas_collection):
     return existing_items_dict
 
 def connectToMongo():
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, model="text-embedding-3-small") 
+    embeddings = get_embeddings(OPENAI_API_KEY, dimensions=DIMENSIONS)
     client = MongoClient(MONGODB_ATLAS_CLUSTER_URI)
     db_name = DB_NAME 
-    collection_name = COLLECTION_NAME_OPENAPI
+    collection_name = resolve_collection_name(client[db_name], COLLECTION_NAME_OPENAPI)
     atlas_collection = client[db_name][collection_name]
-    vector_search_index = "vector_index"
+    vector_search_index = VECTOR_INDEX_NAME
 
     # Create a MongoDBAtlasVectorSearch object
     db = MongoDBAtlasVectorSearch.from_connection_string(
         MONGODB_ATLAS_CLUSTER_URI,
         db_name + "." + collection_name,
         embeddings, #OpenAIEmbeddings(disallowed_special=(), model="text-embedding-3-small") ,
-        index_name = vector_search_index
+        index_name = vector_search_index,
+        embedding_key = EMBEDDING_FIELDS[VECTOR_FORMATS[0]]
     )
     return atlas_collection, db
 
 def main():
     global OPENAI_API_KEY, MONGODB_ATLAS_CLUSTER_URI, DB_NAME, COLLECTION_NAME_OPENAPI
+    global DIMENSIONS, VECTOR_FORMATS, LEXICAL_INDEX_PATH
     
     load_dotenv(override=True)
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -92,12 +104,68 @@ def main():
     print(f"COLLECTION_NAME_OPENAPI: {COLLECTION_NAME_OPENAPI}")
     
     parser = argparse.ArgumentParser(description="Load OpenAPI specs from Elastic Path Docs site in a MongoDB Atlas Cluster")
-    parser.add_argument("--openapi_dir_location", type=str, required=True, help="The location of the OpenAPI specs to load")
+    parser.add_argument("--openapi_dir_location", type=str, help="The location of the OpenAPI specs to load")
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS, help="The size of the embeddings (text-embedding-3-small supports shortened embeddings)")
+    parser.add_argument("--vector_formats", type=str, default="float", 
+                        help="Comma separated embedding storage formats: float, int8, binary (e.g. float,int8)")
+    parser.add_argument("--skip_search_index", action="store_true", help="Only create the regular indexes (e.g. on a local mongod)")
+    parser.add_argument("--wait_for_index", action="store_true", help="Wait for the vector search index to be ready after the load")
+    parser.add_argument("--lexical_index", type=str, help="Also maintain a lexical (BM25 + exact endpoint/operationId) index in this JSON file")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the whole collection in a new generation and cut over to it")
+    parser.add_argument("--cutover", type=str, default="pointer", choices=CUTOVER_MODES, help="How a rebuilt generation is made live")
+    parser.add_argument("--keep_generations", type=int, default=1, help="How many previous generations are kept for rollback")
+    parser.add_argument("--min_count_ratio", type=float, default=0.9, help="Min size of a rebuilt generation compared to the live one")
+    parser.add_argument("--allow_missing_directories", action="store_true",
+                        help="Cut over to a rebuild even if directories of the live collection have no sources in it")
+    parser.add_argument("--rollback", action="store_true", help="Make the previous generation live again")
     args = parser.parse_args()
     
+    if not args.openapi_dir_location and not args.rollback:
+        parser.error("--openapi_dir_location is required")
+    
+    try:
+        VECTOR_FORMATS = parse_vector_formats(args.vector_formats)
+    except ValueError as e:
+        parser.error(str(e))
+    DIMENSIONS = args.dimensions
+    LEXICAL_INDEX_PATH = args.lexical_index
+    
+    if args.rollback:
+        client_db = MongoClient(MONGODB_ATLAS_CLUSTER_URI)[DB_NAME]
+        if rollback(client_db, COLLECTION_NAME_OPENAPI):
+            if LEXICAL_INDEX_PATH:
+                live_collection = client_db[resolve_collection_name(client_db, COLLECTION_NAME_OPENAPI)]
+                build_lexical_index_from_collection(LEXICAL_INDEX_PATH, live_collection)
+            else:
+                print(f"⚠️ A lexical index file of {COLLECTION_NAME_OPENAPI} still matches the generation rolled back from: "
+                      "delete it, the next run with --lexical_index rebuilds it from the collection")
+        return
+    
     repo_path = os.path.expanduser(args.openapi_dir_location)
     api_specs = load_yaml_files(repo_path)
+    if args.rebuild:
+        embeddings = get_embeddings(OPENAI_API_KEY, dimensions=DIMENSIONS)
+        is_live = rebuild_collection(
+            MongoClient(MONGODB_ATLAS_CLUSTER_URI)[DB_NAME], COLLECTION_NAME_OPENAPI, embeddings, api_specs, DIMENSIONS,
+            vector_formats=VECTOR_FORMATS,
+            search_index=not args.skip_search_index,
+            cutover_mode=args.cutover,
+            keep_generations=args.keep_generations,
+            min_count_ratio=args.min_count_ratio,
+            allow_missing_directories=args.allow_missing_directories,
+        )
+        if is_live and LEXICAL_INDEX_PATH:
+            build_lexical_index(LEXICAL_INDEX_PATH, api_specs)
+        return
+    atlas_collection, _ = connectToMongo()
+    try:
+        ensure_indexes(atlas_collection, DIMENSIONS, VECTOR_FORMATS, search_index=not args.skip_search_index)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
     add_to_vectorDB(api_specs)
+    if args.wait_for_index and not args.skip_search_index:
+        wait_for_search_index(atlas_collection)
     
 
 
@@ -0,0 +1,148 @@
+import pytest
+from utils.generations import (cutover, rollback, drop_old_generations, resolve_collection_name, rebuild_collection,
+                               missing_directories, ALIASES_COLLECTION)
+
+mongomock = pytest.importorskip("mongomock")
+
+ALIAS = "docs"
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def load(db, name, marker):
+    db[name].insert_one({"id": "a.md:0", "marker": marker})
+
+
+def live_marker(db):
+    return db[resolve_collection_name(db, ALIAS)].find_one()["marker"]
+
+
+def history(db):
+    return db[ALIASES_COLLECTION].find_one({"_id": ALIAS})["history"]
+
+
+def generation_names(db):
+    return sorted(name for name in db.list_collection_names() if name != ALIASES_COLLECTION)
+
+
+@pytest.mark.parametrize("mode", ["pointer", "rename"])
+def test_cutover_and_rollback(db, mode):
+    load(db, ALIAS, "original")
+    load(db, "docs__gen_1", "gen1")
+    cutover(db, ALIAS, "docs__gen_1", mode)
+    assert live_marker(db) == "gen1"
+    assert len(history(db)) == 1
+
+    load(db, "docs__gen_2", "gen2")
+    cutover(db, ALIAS, "docs__gen_2", mode)
+    assert live_marker(db) == "gen2"
+
+    assert rollback(db, ALIAS)
+    assert live_marker(db) == "gen1"
+    # the generation rolled back from is tracked, rolling back again rolls forward
+    assert rollback(db, ALIAS)
+    assert live_marker(db) == "gen2"
+
+    # every collection but the live one is in the history
+    names = generation_names(db)
+    assert len(names) == 3
+    assert sorted(history(db) + [resolve_collection_name(db, ALIAS)]) == names
+
+
+@pytest.mark.parametrize("mode", ["pointer", "rename"])
+def test_drop_old_generations(db, mode):
+    load(db, ALIAS, "original")
+    for i in range(1, 4):
+        load(db, f"docs__gen_{i}", f"gen{i}")
+        cutover(db, ALIAS, f"docs__gen_{i}", mode)
+    rollback(db, ALIAS)
+
+    drop_old_generations(db, ALIAS, keep=1)
+    assert live_marker(db) == "gen2"
+    assert len(history(db)) == 1
+    assert len(generation_names(db)) == 2
+
+
+def test_pointer_then_rename(db):
+    load(db, ALIAS, "original")
+    load(db, "docs__gen_1", "gen1")
+    cutover(db, ALIAS, "docs__gen_1", "pointer")
+    load(db, "docs__gen_2", "gen2")
+    cutover(db, ALIAS, "docs__gen_2", "rename")
+    assert live_marker(db) == "gen2"
+    assert resolve_collection_name(db, ALIAS) == ALIAS
+
+    # the generation that was live (not the stale original) is the rollback target
+    assert rollback(db, ALIAS)
+    assert live_marker(db) == "gen1"
+
+    names = generation_names(db)
+    assert len(names) == 3
+    assert sorted(history(db) + [resolve_collection_name(db, ALIAS)]) == names
+    drop_old_generations(db, ALIAS, keep=0)
+    assert generation_names(db) == [ALIAS]
+    assert live_marker(db) == "gen1"
+
+
+def test_rename_then_pointer(db):
+    load(db, ALIAS, "original")
+    load(db, "docs__gen_1", "gen1")
+    cutover(db, ALIAS, "docs__gen_1", "rename")
+    load(db, "docs__gen_2", "gen2")
+    cutover(db, ALIAS, "docs__gen_2", "pointer")
+    assert live_marker(db) == "gen2"
+
+    assert rollback(db, ALIAS)
+    assert live_marker(db) == "gen1"
+    assert rollback(db, ALIAS)
+    assert live_marker(db) == "gen2"
+
+    drop_old_generations(db, ALIAS, keep=0)
+    assert generation_names(db) == [resolve_collection_name(db, ALIAS)]
+    assert live_marker(db) == "gen2"
+
+
+def test_rebuild_collection(db):
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    load(db, ALIAS, "original")
+    documents = [Document(page_content="hello", metadata={"source": "a.md", "id": "a.md:0"})]
+    assert rebuild_collection(db, ALIAS, DeterministicFakeEmbedding(size=8), documents, 8, search_index=False,
+                              min_count_ratio=0)
+    assert db[resolve_collection_name(db, ALIAS)].find_one()["text"] == "hello"
+    assert history(db) == [ALIAS]
+
+
+def two_repos():
+    from langchain_core.documents import Document
+
+    return [Document(page_content=f"page {i}", metadata={"source": source, "id": f"{source}:0"})
+            for i, source in enumerate(["website/versioned_docs/version-8.6.x/docs/a.md",
+                                        "website/versioned_docs/version-8.6.x/docs/b.md",
+                                        "website/versioned_docs/version-1.3.x/docs/c.md"])]
+
+
+def rebuild(db, documents, **kwargs):
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    return rebuild_collection(db, ALIAS, DeterministicFakeEmbedding(size=8), documents, 8, search_index=False,
+                              min_count_ratio=0, **kwargs)
+
+
+def test_rebuild_missing_a_live_directory_is_refused(db):
+    documents = two_repos()
+    assert rebuild(db, documents)
+    live = resolve_collection_name(db, ALIAS)
+
+    # a rebuild from one of the two repos only
+    assert not rebuild(db, documents[:2])
+    assert resolve_collection_name(db, ALIAS) == live
+    refused = [name for name in db.list_collection_names() if name not in (live, ALIAS, ALIASES_COLLECTION)][0]
+    assert missing_directories(db[live], db[refused]) == ["website/versioned_docs/version-1.3.x"]
+
+    assert rebuild(db, documents[:2], allow_missing_directories=True)
+    assert resolve_collection_name(db, ALIAS) != live
@@ -0,0 +1,143 @@
+import os
+import subprocess
+import git
+import pytest
+from utils.git import sync_repo
+from utils.documents import get_last_commit_date
+
+GIT_ENV = {"GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@example.com",
+           "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@example.com"}
+
+
+def run_git(cwd, *args):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True,
+                          env={**os.environ, **GIT_ENV}).stdout.strip()
+
+
+def commit_file(work, path, content, date):
+    os.makedirs(os.path.dirname(os.path.join(work, path)), exist_ok=True)
+    with open(os.path.join(work, path), "w") as f:
+        f.write(content)
+    run_git(work, "add", path)
+    subprocess.run(["git", "commit", "-q", "-m", f"update {path}"], cwd=work, check=True,
+                   env={**os.environ, **GIT_ENV, "GIT_AUTHOR_DATE": date, "GIT_COMMITTER_DATE": date})
+    run_git(work, "push", "-q", "origin", "HEAD")
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    """
+    A bare repo (served with file://, so --filter applies) and a working copy to push to it
+    """
+    bare = tmp_path / "upstream.git"
+    run_git(tmp_path, "init", "-q", "--bare", "-b", "main", str(bare))
+    run_git(bare, "config", "uploadpack.allowFilter", "true")
+    work = tmp_path / "work"
+    run_git(tmp_path, "clone", "-q", str(bare), str(work))
+    run_git(work, "checkout", "-q", "-b", "main")
+    commit_file(work, "docs/a.md", "# A", "2024-01-01T00:00:00+00:00")
+    commit_file(work, "other/big.md", "x" * 10000, "2024-01-02T00:00:00+00:00")
+    return str(bare), str(work)
+
+
+def missing_objects(path):
+    return [line for line in run_git(path, "rev-list", "--objects", "--missing=print", "HEAD").splitlines()
+            if line.startswith("?")]
+
+
+def test_first_sync_is_a_sparse_blobless_clone(tmp_path, upstream):
+    bare, _ = upstream
+    checkout = str(tmp_path / "checkout")
+    assert sync_repo(bare, checkout, ["docs"])
+    assert os.path.exists(os.path.join(checkout, "docs/a.md"))
+    assert not os.path.exists(os.path.join(checkout, "other"))
+    # the blob of other/big.md was never downloaded
+    assert len(missing_objects(checkout)) == 1
+
+
+def test_commit_dates_work_with_the_blob_filter(tmp_path, upstream):
+    bare, _ = upstream
+    checkout = str(tmp_path / "checkout")
+    sync_repo(bare, checkout, ["docs"])
+    repo = git.Repo(checkout)
+    assert get_last_commit_date(repo, os.path.join(checkout, "docs/a.md")) == "2024-01-01T00:00:00+00:00"
+    assert get_last_commit_date(repo, os.path.join(checkout, "other/big.md")) == "2024-01-02T00:00:00+00:00"
+
+
+def test_later_syncs_fetch_in_place(tmp_path, upstream):
+    bare, work = upstream
+    checkout = str(tmp_path / "checkout")
+    sync_repo(bare, checkout, ["docs"])
+    commit_file(work, "docs/b.md", "# B", "2024-01-03T00:00:00+00:00")
+
+    assert sync_repo(bare, checkout, ["docs"])
+    assert os.path.exists(os.path.join(checkout, "docs/b.md"))
+    assert git.Repo(checkout).head.commit.hexsha == run_git(work, "rev-parse", "HEAD")
+
+
+def test_sparse_directories_can_be_widened(tmp_path, upstream):
+    bare, _ = upstream
+    checkout = str(tmp_path / "checkout")
+    sync_repo(bare, checkout, ["docs"])
+    assert sync_repo(bare, checkout, ["docs", "other"])
+    assert os.path.exists(os.path.join(checkout, "other/big.md"))
+
+
+def test_another_branch_is_checked_out(tmp_path, upstream):
+    bare, work = upstream
+    checkout = str(tmp_path / "checkout")
+    sync_repo(bare, checkout, ["docs"])
+    run_git(work, "checkout", "-q", "-b", "feature")
+    commit_file(work, "docs/feature.md", "# F", "2024-01-04T00:00:00+00:00")
+
+    assert sync_repo(bare, checkout, ["docs"], "feature")
+    repo = git.Repo(checkout)
+    assert repo.active_branch.name == "feature"
+    assert os.path.exists(os.path.join(checkout, "docs/feature.md"))
+    # main didn't move onto the feature branch
+    assert repo.commit("main").hexsha == run_git(work, "rev-parse", "main")
+
+    assert sync_repo(bare, checkout, ["docs"])
+    assert repo.active_branch.name == "main"
+
+
+def test_a_checkout_of_another_repo_is_refused(tmp_path, upstream):
+    bare, _ = upstream
+    checkout = str(tmp_path / "checkout")
+    sync_repo(bare, checkout, ["docs"])
+    other = tmp_path / "other.git"
+    run_git(tmp_path, "init", "-q", "--bare", str(other))
+
+    assert not sync_repo(str(other), checkout, ["docs"])
+    assert os.path.exists(os.path.join(checkout, "docs/a.md"))
+
+
+def test_existing_directories_are_never_deleted(tmp_path, upstream):
+    bare, work = upstream
+    # not a repo
+    directory = tmp_path / "notes"
+    directory.mkdir()
+    (directory / "keep.txt").write_text("keep")
+    assert not sync_repo(bare, str(directory), ["docs"])
+    assert (directory / "keep.txt").exists()
+
+    # a subdirectory of a checkout
+    assert not sync_repo(bare, os.path.join(work, "docs"), ["docs"])
+    assert os.path.exists(os.path.join(work, "docs/a.md"))
+
+    # a worktree (.git is a file) of a checkout without the same origin
+    worktree = str(tmp_path / "worktree")
+    run_git(work, "worktree", "add", "-q", worktree)
+    assert not sync_repo(str(tmp_path / "unrelated"), worktree, ["docs"])
+    assert os.path.exists(os.path.join(worktree, "docs/a.md"))
+    # and of the same origin: it is synced in place (or fails), never deleted and cloned again
+    sync_repo(bare, worktree, ["docs"])
+    # still the worktree (a clone would have a .git directory)
+    assert os.path.isfile(os.path.join(worktree, ".git"))
+    assert os.path.exists(os.path.join(worktree, "docs/a.md"))
+
+    # an empty directory is cloned into
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    assert sync_repo(bare, str(empty), ["docs"])
+    assert (empty / "docs/a.md").exists()
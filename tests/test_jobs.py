@@ -0,0 +1,176 @@
+import os
+import time
+import uuid
+import multiprocessing
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from utils.jobs import (plan_work_units, create_job, lease_work_unit, renew_lease, complete_work_unit, fail_work_unit,
+                        reap_expired_leases, job_status, LeaseLostError, PENDING, LEASED, DONE, FAILED)
+from utils.chunks import ChunkRecord
+
+# the lease logic relies on server-side operators ($$NOW in update pipelines), so it needs a real mongod
+MONGODB_TEST_URI = os.getenv("MONGODB_TEST_URI", "mongodb://localhost:27017")
+JOB_ID = "job"
+
+
+def connect():
+    return MongoClient(MONGODB_TEST_URI, serverSelectionTimeoutMS=1000)
+
+
+@pytest.fixture(scope="module")
+def client():
+    client = connect()
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"no mongod at {MONGODB_TEST_URI}")
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def jobs_collection(client):
+    db_name = f"test_jobs_{uuid.uuid4().hex[:8]}"
+    yield client[db_name]["ingest_jobs"]
+    client.drop_database(db_name)
+
+
+def create_units(jobs_collection, num_sources=20, num_partitions=4):
+    sources = [f"docs/page-{i}.md" for i in range(num_sources)]
+    units = plan_work_units({"docs": sources}, num_partitions)
+    create_job(jobs_collection, JOB_ID, units, {"doc_site": "EPCC"})
+    return units
+
+
+def expire():
+    # leases of 0 seconds expire as soon as the server clock moves
+    time.sleep(0.05)
+
+
+def test_lease_is_exclusive(jobs_collection):
+    create_units(jobs_collection, num_sources=1, num_partitions=1)
+    unit = lease_work_unit(jobs_collection, JOB_ID, "worker-a", 60, 3)
+    assert unit["status"] == LEASED and unit["lease_owner"] == "worker-a" and unit["attempts"] == 1
+    assert lease_work_unit(jobs_collection, JOB_ID, "worker-b", 60, 3) is None
+    assert renew_lease(jobs_collection, unit["_id"], "worker-a", 60)
+    assert not renew_lease(jobs_collection, unit["_id"], "worker-b", 60)
+
+
+def _lease_all(db_name, worker_id):
+    client = connect()
+    jobs_collection = client[db_name]["ingest_jobs"]
+    leased = []
+    while (unit := lease_work_unit(jobs_collection, JOB_ID, worker_id, 60, 3)) is not None:
+        leased.append(unit["_id"])
+        complete_work_unit(jobs_collection, unit["_id"], worker_id, {})
+    client.close()
+    return leased
+
+
+def test_lease_is_exclusive_across_processes(jobs_collection):
+    units = create_units(jobs_collection, num_sources=200, num_partitions=32)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(4) as pool:
+        results = pool.starmap(_lease_all, [(jobs_collection.database.name, f"worker-{i}") for i in range(4)])
+    leased = [unit_id for result in results for unit_id in result]
+    assert len(leased) == len(set(leased)) == len(units)
+    assert job_status(jobs_collection, JOB_ID)[DONE] == len(units)
+
+
+def test_expired_lease_is_leased_again(jobs_collection):
+    create_units(jobs_collection, num_sources=1, num_partitions=1)
+    unit = lease_work_unit(jobs_collection, JOB_ID, "worker-a", 0, 3)
+    expire()
+    retry = lease_work_unit(jobs_collection, JOB_ID, "worker-b", 60, 3)
+    assert retry["_id"] == unit["_id"]
+    assert retry["lease_owner"] == "worker-b" and retry["attempts"] == 2
+    # the lease expires on the server clock, in the future
+    assert retry["lease_expires_at"] > unit["lease_expires_at"]
+
+
+def test_max_attempts_fails_the_unit(jobs_collection):
+    create_units(jobs_collection, num_sources=2, num_partitions=2)
+    # an error on the last attempt
+    unit = lease_work_unit(jobs_collection, JOB_ID, "worker-a", 60, 1)
+    assert fail_work_unit(jobs_collection, unit["_id"], "worker-a", "boom", 1)
+    assert jobs_collection.find_one({"_id": unit["_id"]})["status"] == FAILED
+    # a worker that died on the last attempt
+    unit = lease_work_unit(jobs_collection, JOB_ID, "worker-b", 0, 1)
+    expire()
+    assert lease_work_unit(jobs_collection, JOB_ID, "worker-c", 60, 1) is None
+    assert reap_expired_leases(jobs_collection, JOB_ID, 1) == 1
+    assert job_status(jobs_collection, JOB_ID) == {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 2}
+
+
+def test_failed_attempt_goes_back_to_pending(jobs_collection):
+    create_units(jobs_collection, num_sources=1, num_partitions=1)
+    unit = lease_work_unit(jobs_collection, JOB_ID, "worker-a", 60, 3)
+    assert fail_work_unit(jobs_collection, unit["_id"], "worker-a", "boom", 3)
+    assert jobs_collection.find_one({"_id": unit["_id"]})["status"] == PENDING
+
+
+def test_complete_after_the_lease_was_lost(jobs_collection):
+    create_units(jobs_collection, num_sources=1, num_partitions=1)
+    unit = lease_work_unit(jobs_collection, JOB_ID, "worker-a", 0, 3)
+    expire()
+    lease_work_unit(jobs_collection, JOB_ID, "worker-b", 60, 3)
+    assert not renew_lease(jobs_collection, unit["_id"], "worker-a", 60)
+    assert not complete_work_unit(jobs_collection, unit["_id"], "worker-a", {})
+    assert complete_work_unit(jobs_collection, unit["_id"], "worker-b", {})
+    assert jobs_collection.find_one({"_id": unit["_id"]})["status"] == DONE
+
+
+class FakeLease:
+    """
+    A lease that is lost after `checks` successful checks
+    """
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    def check(self):
+        if self.checks == 0:
+            raise LeaseLostError("lost")
+        self.checks -= 1
+
+
+def chunk_records(source, date, count):
+    text = "".join(f"chunk {i:04d}. " for i in range(count))
+    return [ChunkRecord(source, date, None, text, i * 12, (i + 1) * 12, i) for i in range(count)]
+
+
+@pytest.fixture
+def connection(client):
+    from types import SimpleNamespace
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    db_name = f"test_worker_{uuid.uuid4().hex[:8]}"
+    yield client[db_name]["docs"], SimpleNamespace(embeddings=DeterministicFakeEmbedding(size=8))
+    client.drop_database(db_name)
+
+
+def test_retry_repairs_a_half_written_unit(connection):
+    from populate_db import add_to_vectorDB
+
+    collection = connection[0]
+    # a previous attempt wrote the first chunk of the new version of the source and died
+    add_to_vectorDB(chunk_records("a.md", "2024-02-01", 3)[:1], ["a.md"], connection=connection)
+    records = chunk_records("a.md", "2024-02-01", 3)
+    add_to_vectorDB(records, ["a.md"], connection=connection)
+    assert collection.count_documents({}) == 1
+
+    add_to_vectorDB(records, ["a.md"], connection=connection, replace_all=True)
+    assert sorted(collection.distinct("id")) == ["a.md:0", "a.md:1", "a.md:2"]
+
+
+def test_lost_lease_stops_the_writes(connection):
+    import populate_db
+
+    collection = connection[0]
+    # enough chunks for two batches of upsert_documents
+    records = chunk_records("a.md", "2024-02-01", 600)
+    # the check after the diff and the one before the first batch pass
+    with pytest.raises(LeaseLostError):
+        populate_db.add_to_vectorDB(records, ["a.md"], FakeLease(2), connection=connection)
+    assert collection.count_documents({}) == 500
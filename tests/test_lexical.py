@@ -0,0 +1,41 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from utils.lexical import LexicalIndex, update_lexical_index, build_lexical_index_from_collection
+from utils.mongo import upsert_documents
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def endpoint(method, path, operation_id):
+    return Document(page_content=f"{method} {path}\nDescription: {operation_id}",
+                    metadata={"source": "carts.yaml", "id": f"{method} {path}", "operationId": operation_id,
+                              "api_name": "carts", "last_commit_date": "2024-01-01"})
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().db.openapi
+    documents = [endpoint("GET", "/v2/carts/{cartID}", "getCart"), endpoint("POST", "/v2/carts", "createCart")]
+    upsert_documents(collection, DeterministicFakeEmbedding(size=8), documents,
+                     ids=[doc.metadata["id"] for doc in documents], replace=False)
+    return collection
+
+
+def test_missing_file_is_built_from_the_collection(tmp_path, collection):
+    file_path = str(tmp_path / "lexical.json")
+    # nothing changed in this run, the index still has every document of the collection
+    update_lexical_index(file_path, collection, [], [])
+    index = LexicalIndex.load(file_path)
+    assert index.exact_lookup("GET /v2/carts/{id}") == ["carts.yaml#GET /v2/carts/{cartID}"]
+    assert index.exact_lookup("createCart") == ["carts.yaml#POST /v2/carts"]
+
+
+def test_existing_file_is_updated(tmp_path, collection):
+    file_path = str(tmp_path / "lexical.json")
+    build_lexical_index_from_collection(file_path, collection)
+    update_lexical_index(file_path, collection, ["POST /v2/carts"], [endpoint("DELETE", "/v2/carts/{cartID}", "deleteCart")])
+    index = LexicalIndex.load(file_path)
+    assert index.exact_lookup("createCart") == []
+    assert index.exact_lookup("deleteCart") == ["carts.yaml#DELETE /v2/carts/{cartID}"]
+    assert len(index.entries) == 2
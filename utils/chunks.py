@@ -0,0 +1,148 @@
+import os
+import sys
+from collections.abc import Sequence
+from langchain_core.documents import Document
+from utils.documents import open_git_repo, get_last_commit_date, get_text_splitter, transform_path
+
+"""
+Compact representation of the markdown files and their chunks for the load -> split -> diff stages.
+A chunk only keeps a reference to the text of its file and its offsets in it, the source and date strings
+are interned and the id is computed when needed. LangChain Documents are only built for the chunks that are
+embedded and written (see ChunkRecord.to_document and RecordDocuments).
+"""
+
+
+class ChunkRecord:
+    __slots__ = ("source", "last_commit_date", "url", "text", "start", "end", "index")
+
+    def __init__(self, source, last_commit_date, url, text, start=0, end=None, index=0):
+        self.source = source
+        self.last_commit_date = last_commit_date
+        self.url = url
+        # the text of the whole file, shared by all the chunks of the file
+        self.text = text
+        self.start = start
+        self.end = len(text) if end is None else end
+        self.index = index
+
+    @property
+    def content(self):
+        return self.text[self.start:self.end]
+
+    @property
+    def id(self):
+        # same ids as calculate_chunk_ids, e.g. "docs/commerce-manager/index.mdx:2"
+        return f"{self.source}:{self.index}"
+
+    def to_document(self):
+        metadata = {"source": self.source, "last_commit_date": self.last_commit_date}
+        if self.url:
+            metadata["url"] = self.url
+        metadata["id"] = self.id
+        return Document(page_content=self.content, metadata=metadata)
+
+
+class RecordDocuments(Sequence):
+    """
+    A read-only list of Documents built on access from chunk records,
+    so that the writers (which work in batches) never hold all the Documents at once
+    """
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [record.to_document() for record in self.records[item]]
+        return self.records[item].to_document()
+
+
+def _intern(value):
+    return sys.intern(value) if value else value
+
+
+def load_md_records(temp_repo_path, sources, base_url=None, git_search_path=None):
+    """
+    Same as load_md_sources, but returns one ChunkRecord per file
+
+    :param temp_repo_path: the path of the repo where the files are located
+    :param sources: the file paths relative to `temp_repo_path`
+    :param base_url: the base url of the documentation site (only used for EPSM)
+    :param git_search_path: where to start looking for the git repository, defaults to `temp_repo_path`
+    """
+    repo = open_git_repo(git_search_path or temp_repo_path)
+    records = []
+    for relative_path in sources:
+        file_path = os.path.join(temp_repo_path, relative_path)
+        last_commit_date = get_last_commit_date(repo, file_path)
+        # same as LangChain's TextLoader
+        with open(file_path) as f:
+            text = f.read()
+        url = base_url + "/" + transform_path(relative_path) if base_url else None
+        records.append(ChunkRecord(_intern(relative_path), _intern(last_commit_date), url, text))
+    return records
+
+
+def split_records(chunk_size, file_records, chunk_overlap=0.1, mode="recursive"):
+    """
+    Split the file records with the same splitter as split_documents.
+    The chunks keep offsets into the text of their file instead of a copy of their content.
+    """
+    print(f"Splitting {len(file_records)} files into chunks of {chunk_size} characters")
+    text_splitter = get_text_splitter(chunk_size, chunk_overlap, mode)
+    overlap = int(text_splitter._chunk_overlap)
+    chunks = []
+    for file_record in file_records:
+        text = file_record.text
+        search_from = 0
+        previous_length = 0
+        for index, content in enumerate(text_splitter.split_text(text)):
+            # find the chunk in the file like the splitter does with add_start_index
+            start = text.find(content, max(0, search_from + previous_length - overlap))
+            if start == -1:
+                # not a substring of the file (shouldn't happen), keep its own copy
+                chunks.append(ChunkRecord(file_record.source, file_record.last_commit_date, file_record.url,
+                                          content, index=index))
+                continue
+            chunks.append(ChunkRecord(file_record.source, file_record.last_commit_date, file_record.url,
+                                      text, start, start + len(content), index))
+            search_from = start
+            previous_length = len(content)
+    return chunks
+
+
+def get_existing_dates(atlas_collection, sources=None):
+    """
+    Get the last_commit_date of every source in the collection (or only of the given sources).
+    All the chunks of a source are written together with the same date, so the date of one of them
+    stands for the whole source.
+    """
+    pipeline = [{"$group": {"_id": "$source", "last_commit_date": {"$first": "$last_commit_date"}}}]
+    if sources is not None:
+        pipeline.insert(0, {"$match": {"source": {"$in": list(sources)}}})
+    return {_intern(item["_id"]): item["last_commit_date"] for item in atlas_collection.aggregate(pipeline)}
+
+
+def compare_chunk_records(chunks, existing_dates: dict):
+    """
+    Diff the chunk records against the dates of get_existing_dates: the chunks of a source missing from the
+    collection are new, the chunks of a source with a more recent date are written again and their ids deleted first.
+    Sources with the same or an older date are skipped.
+
+    :return: the ids to delete and the new/updated chunk records
+    """
+    new_chunks = []
+    to_delete_chunks = []
+    for chunk in chunks:
+        if chunk.source not in existing_dates:
+            # Completely new source
+            new_chunks.append(chunk)
+        elif chunk.last_commit_date > existing_dates[chunk.source]:
+            if chunk.index == 0:
+                print(f"UPDATING: md file {chunk.source} date: {chunk.last_commit_date} is more recent")
+            new_chunks.append(chunk)
+            to_delete_chunks.append(chunk.id)
+    return to_delete_chunks, new_chunks
@@ -2,7 +2,7 @@ import os
 import glob
 from langchain_community.document_loaders import TextLoader, UnstructuredMarkdownLoader
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.text_splitter import RecursiveCharacterTextSplitter, Language
 import git
 import re
 
@@ -14,7 +14,19 @@ def transform_path(file_path):
     return new_path
 
 
-def load_md_files(temp_repo_path, directory_to_load, base_url):
+def find_md_sources(temp_repo_path, directory_to_load):
+    """
+    Find all .md and .mdx files in a directory and its subdirectories.
+    
+    :return: the list of sources, i.e. the file paths relative to `temp_repo_path`
+    """
+    directory = os.path.join(temp_repo_path, directory_to_load)
+    md_files = glob.glob(os.path.join(directory, '**', '*.md*'), recursive=True)
+    print(f"in {directory} found {len(md_files)} .md files")
+    return [os.path.relpath(file_path, temp_repo_path) for file_path in md_files]
+
+
+def load_md_files(temp_repo_path, directory_to_load, base_url=None):
     """
     This function loads Markdown files from a specified directory within a temporary repository path.
     
@@ -31,41 +43,37 @@ def load_md_files(temp_repo_path, directory_to_load, base_url):
     in the metadata
     
     """
-    # Find all .md and .mdx files in the directory and subdirectories
-    directory =os.path.join(temp_repo_path, directory_to_load)
+    directory = os.path.join(temp_repo_path, directory_to_load)
     #directory = os.path.expanduser(directory)  # Expand ~ to full home directory path
     print(f"Searching in directory: {os.path.abspath(directory)}")
     
-    md_files = glob.glob(os.path.join(directory, '**', '*.md*'), recursive=True) 
-    print(f"in {directory} found {len(md_files)} .md files")
+    sources = find_md_sources(temp_repo_path, directory_to_load)
+    return load_md_sources(temp_repo_path, sources, base_url, git_search_path=directory)
+
+
+def load_md_sources(temp_repo_path, sources, base_url=None, git_search_path=None):
+    """
+    Load a given list of Markdown files, e.g. the sources of a work unit.
     
+    :param temp_repo_path: the path of the repo where the files are located
+    :param sources: the file paths relative to `temp_repo_path`
+    :param base_url: the base url of the documentation site (only used for EPSM)
+    :param git_search_path: where to start looking for the git repository, defaults to `temp_repo_path`
+    :return: A list of Document objects with the last commit date and source in the metadata
+    """
+    repo = open_git_repo(git_search_path or temp_repo_path)
     documents = []
-    try:
-        repo = git.Repo(directory, search_parent_directories=True)
-        repo_root = repo.working_tree_dir  # Get the root directory of the repo
-        print(f"Found git repository at: {repo.git_dir}")
-    except git.exc.InvalidGitRepositoryError:
-        print(f"Warning: No git repository found for {directory}")
-        repo = None
     
-    for file_path in md_files:
+    for relative_path in sources:
+        file_path = os.path.join(temp_repo_path, relative_path)
         # Get the last commit date for the file using git log (only if repo exists)
-        last_commit_date = None
-        if repo:
-            try:
-                # Convert absolute path to relative path from repo root
-                relative_path = os.path.relpath(file_path, repo_root)
-                last_commit_date = repo.git.log('-1', '--format=%cI', '--', relative_path)
-            except git.exc.GitCommandError as e:
-                print(f"Error getting git log: {e}")
-                print(f"No git history found for {file_path}")
+        last_commit_date = get_last_commit_date(repo, file_path)
         
         # Load each .md file using LangChain's TextLoader
         #print(f"Loading {file_path}")
         loader = TextLoader(file_path)
         file_documents = loader.load()
         for doc in file_documents:
-            relative_path = os.path.relpath(file_path, temp_repo_path)
             doc.metadata["source"] = relative_path
             doc.metadata["last_commit_date"] = last_commit_date
             if base_url:
@@ -76,6 +84,36 @@ def load_md_files(temp_repo_path, directory_to_load, base_url):
 
 
 
+def open_git_repo(path):
+    """
+    Find the git repository containing `path`, None if there is none
+    """
+    try:
+        repo = git.Repo(path, search_parent_directories=True)
+        print(f"Found git repository at: {repo.git_dir}")
+        return repo
+    except git.exc.InvalidGitRepositoryError:
+        print(f"Warning: No git repository found for {path}")
+        return None
+
+
+def get_last_commit_date(repo, file_path):
+    """
+    The date of the last commit of a file (ISO 8601), None if unknown
+    """
+    if not repo:
+        return None
+    try:
+        # Convert absolute path to relative path from repo root
+        repo_relative_path = os.path.relpath(file_path, repo.working_tree_dir)
+        return repo.git.log('-1', '--format=%cI', '--', repo_relative_path)
+    except git.exc.GitCommandError as e:
+        print(f"Error getting git log: {e}")
+        print(f"No git history found for {file_path}")
+        return None
+
+
+
 def calculate_chunk_ids(chunks):
     """
     This function calculates and adds the IDs for the given list of chunks.
@@ -115,14 +153,34 @@ def calculate_chunk_ids(chunks):
         
     return chunks
 
-def split_documents(chunk_size, documents: list[Document]):
+SPLITTER_MODES = ["recursive", "markdown"]
+
+def get_text_splitter(chunk_size, chunk_overlap=0.1, mode="recursive"):
+    """
+    :param chunk_overlap: the overlap between chunks, as a fraction of the chunk size
+    :param mode: "recursive" splits on paragraphs/lines/words, "markdown" splits on markdown headings first
+    """
+    if mode == "markdown":
+        return RecursiveCharacterTextSplitter.from_language(
+            Language.MARKDOWN,
+            chunk_size=chunk_size,
+            chunk_overlap=int(chunk_size * chunk_overlap),
+        )
+    if mode == "recursive":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_size * chunk_overlap,
+            length_function=len,
+            is_separator_regex=False,
+        )
+    raise ValueError(f"Unknown splitter mode: {mode}")
+
+def split_documents(chunk_size, documents: list[Document], chunk_overlap=0.1, mode="recursive"):
+    """
+    Split the documents in chunks of `chunk_size` characters, see get_text_splitter for the options
+    """
     print(f"Splitting {len(documents)} documents into chunks of {chunk_size} characters")
     # for doc in documents:
     #     print(f"Document: {doc.page_content}")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_size * 0.1,
-        length_function=len,
-        is_separator_regex=False,
-    )
+    text_splitter = get_text_splitter(chunk_size, chunk_overlap, mode)
     return text_splitter.split_documents(documents)
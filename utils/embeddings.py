@@ -0,0 +1,36 @@
+from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+
+
+def get_embeddings(openai_api_key, fake=False, dimensions=EMBEDDING_DIMENSIONS, cache_dir=None):
+    """
+    Return the embeddings model used to populate the vector DB.
+
+    :param openai_api_key: the OpenAI API key
+    :param fake: use deterministic fake embeddings (no OpenAI calls), useful to test against a local mongod
+    :param dimensions: the size of the embeddings, the text-embedding-3 models can return shortened embeddings
+    :param cache_dir: cache the OpenAI embeddings (documents and queries) in this directory,
+    once the cache is filled the same texts are embedded without OpenAI calls
+    """
+    if dimensions > EMBEDDING_DIMENSIONS:
+        raise ValueError(f"{EMBEDDING_MODEL} supports at most {EMBEDDING_DIMENSIONS} dimensions, got {dimensions}")
+    if fake:
+        print("⚠️ Using fake embeddings")
+        return DeterministicFakeEmbedding(size=dimensions)
+    if dimensions != EMBEDDING_DIMENSIONS:
+        embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, model=EMBEDDING_MODEL, dimensions=dimensions)
+    else:
+        embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, model=EMBEDDING_MODEL)
+    if cache_dir:
+        return CacheBackedEmbeddings.from_bytes_store(
+            embeddings,
+            LocalFileStore(cache_dir),
+            namespace=f"{EMBEDDING_MODEL}-{dimensions}",
+            query_embedding_cache=True,
+        )
+    return embeddings
@@ -0,0 +1,233 @@
+from datetime import datetime, timezone
+from pymongo.errors import OperationFailure
+from utils.mongo import (upsert_documents, ensure_indexes, wait_for_search_index, source_prefixes, EMBEDDING_FIELDS,
+                         VECTOR_INDEX_NAME)
+
+"""
+Blue/green rebuilds: a full rebuild is loaded into a new collection (a "generation"),
+validated, and only then made live. The previous generations are kept for rollback.
+
+Two cutover modes:
+- pointer: a document in the aliases collection maps the collection name (the alias) to the live generation.
+  The swap is a single atomic document update, readers resolve the name with resolve_collection_name.
+- rename: the live collection is renamed to a backup generation and the new generation takes its name,
+  readers don't need to change but the collection is missing for the short time between the two renames.
+"""
+
+ALIASES_COLLECTION = "collection_aliases"
+CUTOVER_MODES = ["pointer", "rename"]
+
+
+def resolve_collection_name(db, alias, aliases_collection=ALIASES_COLLECTION):
+    """
+    Return the collection readers and incremental loads should use for `alias`
+    """
+    pointer = db[aliases_collection].find_one({"_id": alias})
+    return pointer["collection"] if pointer and pointer.get("collection") else alias
+
+
+def new_generation_name(alias):
+    return f"{alias}__gen_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}"
+
+
+def load_generation(collection, embeddings, documents, dimensions, ids=None, vector_formats=("float",),
+                    search_index=True, wait=True):
+    """
+    Load all the documents in an empty collection, then build its indexes.
+    Inserts are unordered and there are no indexes to maintain during the load except _id.
+    """
+    print(f"👉 Loading {len(documents)} documents in {collection.name}")
+    upsert_documents(collection, embeddings, documents, ids, vector_formats, replace=False)
+    # the generation was loaded with these dimensions and formats, its index must match them
+    ensure_indexes(collection, dimensions, vector_formats, search_index=search_index, allow_vector_changes=True)
+    if search_index and wait:
+        wait_for_search_index(collection)
+
+
+def directories(collection):
+    """
+    All the directories of the sources of a collection (from `source`, older documents have no source_prefixes)
+    """
+    return {prefix for source in collection.distinct("source") if source for prefix in source_prefixes(source)}
+
+
+def missing_directories(live_collection, collection):
+    """
+    The directories of the live collection that have no source in the new generation, e.g. the other repo
+    of a collection loaded from two repos. Only the top-most missing ones are returned.
+    """
+    missing = directories(live_collection) - directories(collection)
+    return sorted(prefix for prefix in missing if prefix.rpartition("/")[0] not in missing)
+
+
+def validate_generation(collection, expected_count, live_count, vector_format="float", min_count_ratio=0.9,
+                        sample_size=20, search_index=True, live_collection=None, allow_missing_directories=False):
+    """
+    Check a new generation before cutting over:
+    - it has all the documents that were loaded
+    - it is not much smaller than the live collection
+    - it has sources in every directory of the live collection (a rebuild must load everything the collection holds)
+    - (with a search index) sample documents are found by a vector search with their own embedding
+
+    :return: a list of problems, empty if the generation is valid
+    """
+    problems = []
+    count = collection.count_documents({})
+    if count != expected_count:
+        problems.append(f"{count} documents instead of {expected_count}")
+    if live_count and count < live_count * min_count_ratio:
+        problems.append(f"{count} documents, live collection has {live_count}")
+    if live_collection is not None and not allow_missing_directories:
+        missing = missing_directories(live_collection, collection)
+        if missing:
+            problems.append(f"no sources in {', '.join(missing)} of the live collection "
+                            "(use --allow_missing_directories if they were removed on purpose)")
+
+    if search_index and count:
+        path = EMBEDDING_FIELDS[vector_format]
+        samples = list(collection.aggregate([{"$sample": {"size": sample_size}}, {"$project": {path: 1}}]))
+        found = 0
+        for sample in samples:
+            try:
+                results = collection.aggregate([
+                    {"$vectorSearch": {"index": VECTOR_INDEX_NAME, "path": path, "queryVector": sample[path],
+                                       "numCandidates": 100, "limit": 10}},
+                    {"$project": {"_id": 1}},
+                ])
+            except OperationFailure as e:
+                problems.append(f"sample query failed: {e}")
+                break
+            found += any(result["_id"] == sample["_id"] for result in results)
+        if samples and found < len(samples) * 0.9:
+            problems.append(f"only {found}/{len(samples)} sample documents found by their own embedding")
+    return problems
+
+
+def _unused_name(db, name):
+    existing = set(db.list_collection_names())
+    candidate, suffix = name, 1
+    while candidate in existing:
+        suffix += 1
+        candidate = f"{name}_{suffix}"
+    return candidate
+
+
+def _backup_name(db, alias, now, label):
+    return _unused_name(db, f"{alias}__gen_{now.strftime('%Y%m%dT%H%M%S')}_{label}")
+
+
+def cutover(db, alias, generation, mode="pointer", aliases_collection=ALIASES_COLLECTION):
+    """
+    Make `generation` the live collection for `alias`.
+    The generation that was live is recorded first in the history, for rollback or to be dropped later.
+    """
+    now = datetime.now(timezone.utc)
+    pointer = db[aliases_collection].find_one({"_id": alias}) or {}
+    history = list(pointer.get("history", []))
+    live = resolve_collection_name(db, alias, aliases_collection)
+    collection_names = db.list_collection_names()
+    if mode == "pointer":
+        collection = generation
+    elif mode == "rename":
+        if alias in collection_names:
+            # the collection named `alias` is either live (plain or rename cutover)
+            # or a stale one left behind by a pointer cutover, keep it as a generation in both cases
+            backup = _backup_name(db, alias, now, "prev")
+            db[alias].rename(backup)
+            history = [backup if name == alias else name for name in history]
+            if live == alias:
+                live = backup
+        db[generation].rename(alias)
+        collection = None
+    else:
+        raise ValueError(f"Unknown cutover mode: {mode}")
+    if live != alias or alias in collection_names:
+        history.insert(0, live)
+    db[aliases_collection].update_one(
+        {"_id": alias},
+        {"$set": {"collection": collection, "mode": mode, "updated_at": now, "history": history}},
+        upsert=True,
+    )
+    print(f"🔀 {alias} now points to {generation} ({mode})")
+
+
+def rollback(db, alias, aliases_collection=ALIASES_COLLECTION):
+    """
+    Make the previous generation live again. The generation rolled back from takes its place in the history,
+    so rolling back twice rolls forward again.
+    """
+    pointer = db[aliases_collection].find_one({"_id": alias})
+    if not pointer or not pointer.get("history"):
+        print(f"❌ No previous generation to roll back to for {alias}")
+        return False
+    history = list(pointer["history"])
+    previous = history[0]
+    if previous not in db.list_collection_names():
+        print(f"❌ Previous generation {previous} of {alias} doesn't exist anymore")
+        return False
+    now = datetime.now(timezone.utc)
+    if pointer.get("collection"):
+        # pointer cutover: the generations keep their names
+        left = pointer["collection"]
+        collection = None if previous == alias else previous
+    else:
+        # rename cutover: the live generation is the collection named `alias`
+        left = _backup_name(db, alias, now, "rolledback")
+        db[alias].rename(left)
+        db[previous].rename(alias)
+        collection = None
+    history[0] = left
+    db[aliases_collection].update_one(
+        {"_id": alias},
+        {"$set": {"collection": collection, "updated_at": now, "history": history}},
+    )
+    print(f"⏪ {alias} rolled back to {previous}, {left} kept in the history")
+    return True
+
+
+def drop_old_generations(db, alias, keep=1, aliases_collection=ALIASES_COLLECTION):
+    """
+    Drop the generations older than the `keep` most recent previous ones
+    """
+    pointer = db[aliases_collection].find_one({"_id": alias})
+    if not pointer:
+        return []
+    history = pointer.get("history", [])
+    live = resolve_collection_name(db, alias, aliases_collection)
+    dropped = [name for name in history[keep:] if name != live]
+    for name in dropped:
+        print(f"🗑️ Dropping old generation {name}")
+        db.drop_collection(name)
+    db[aliases_collection].update_one({"_id": alias}, {"$set": {"history": history[:keep]}})
+    return dropped
+
+
+def rebuild_collection(db, alias, embeddings, documents, dimensions, ids=None, vector_formats=("float",),
+                       search_index=True, cutover_mode="pointer", keep_generations=1, min_count_ratio=0.9,
+                       allow_missing_directories=False):
+    """
+    Load the documents in a new generation, validate it and cut over to it.
+    If the validation fails the live collection is left unchanged and the new generation is kept for inspection.
+
+    :return: True if the new generation is live
+    """
+    live = resolve_collection_name(db, alias)
+    live_exists = live in db.list_collection_names()
+    live_count = db[live].estimated_document_count() if live_exists else 0
+    # never load into an existing collection, e.g. of a rebuild started in the same second
+    generation = _unused_name(db, new_generation_name(alias))
+
+    load_generation(db[generation], embeddings, documents, dimensions, ids, vector_formats, search_index)
+    problems = validate_generation(db[generation], len(documents), live_count, vector_formats[0],
+                                   min_count_ratio, search_index=search_index,
+                                   live_collection=db[live] if live_exists else None,
+                                   allow_missing_directories=allow_missing_directories)
+    if problems:
+        for problem in problems:
+            print(f"❌ {generation}: {problem}")
+        print(f"❌ Not cutting over, {alias} still points to {live}")
+        return False
+
+    cutover(db, alias, generation, cutover_mode)
+    drop_old_generations(db, alias, keep_generations)
+    return True
@@ -33,6 +33,93 @@ def clone_repo(git_repo_url, temp_repo_path="~/temp_repo"):
 
 
 
+def _normalize_url(url):
+    url = url.strip().rstrip("/")
+    # a local repo can be given as a path or a file:// url
+    if url.startswith("file://"):
+        url = url[len("file://"):]
+    if os.path.isabs(url):
+        url = os.path.normpath(url)
+    return url[:-len(".git")] if url.endswith(".git") else url
+
+
+def sync_repo(git_repo_url, temp_repo_path="~/temp_repo", directories=None, branch=None):
+    """
+    Keep a local copy of the repo up to date, downloading only what is needed.
+    
+    The first call does a partial clone without file contents (--filter=blob:none) and a sparse
+    checkout of `directories`, so only the blobs of those directories are downloaded.
+    The commits and trees are all there, so `git log -- <path>` (used for the last commit dates) works.
+    Later calls fetch and check out the latest commit of the branch in place, updating the sparse directories
+    if they changed. The repo is only cloned into a missing or empty directory: any other existing directory
+    (not a repo, or a checkout of another repo) is left alone.
+    
+    :param git_repo_url: the url of the repo. A local path is turned into a file:// url since git ignores
+    --filter for local clones (the source repo needs uploadpack.allowFilter=true)
+    :param temp_repo_path: where the repo is checked out
+    :param directories: the directories to check out, None for the whole repo
+    :param branch: the branch to check out, defaults to the remote default branch
+    :return: True if the repo is up to date
+    """
+    
+    class Progress(RemoteProgress):
+        def update(self, op_code, cur_count, max_count=None, message=''):
+            print(f'\rProgress: {cur_count}/{max_count} {message}', end='')
+    
+    if os.path.isdir(os.path.expanduser(git_repo_url)):
+        git_repo_url = "file://" + os.path.abspath(os.path.expanduser(git_repo_url))
+    
+    try:
+        temp_repo_path = os.path.expanduser(temp_repo_path)
+        if os.path.exists(temp_repo_path) and os.listdir(temp_repo_path):
+            try:
+                # also opens worktrees, where .git is a file
+                repo = git.Repo(temp_repo_path)
+            except git.InvalidGitRepositoryError:
+                print(f"❌ {temp_repo_path} exists and is not the root of a git checkout, not cloning into it")
+                return False
+            origin_url = repo.remotes.origin.url if "origin" in repo.remotes else None
+            if origin_url is None or _normalize_url(origin_url) != _normalize_url(git_repo_url):
+                print(f"❌ {temp_repo_path} is a checkout of {origin_url}, not {git_repo_url}")
+                return False
+            if directories:
+                repo.git.sparse_checkout("set", *directories)
+            print(f"Fetching {git_repo_url} into {temp_repo_path}")
+            repo.remotes.origin.fetch(progress=Progress())
+            if not branch:
+                # origin/HEAD is set by the clone to the remote default branch
+                try:
+                    branch = repo.git.rev_parse("--abbrev-ref", "origin/HEAD").split("/", 1)[1]
+                except git.GitCommandError:
+                    branch = repo.active_branch.name
+            # switch to the branch (it may not be the one checked out) and move it to the fetched commit
+            repo.git.checkout("-B", branch, f"origin/{branch}")
+            print(f"\n✅ Repository updated to {repo.head.commit.hexsha[:8]} in {temp_repo_path}")
+            return True
+        
+        multi_options = ["--filter=blob:none"]
+        if directories:
+            multi_options.append("--sparse")
+        if branch:
+            multi_options.append(f"--branch={branch}")
+        print(f"Cloning {git_repo_url} into {temp_repo_path}")
+        repo = git.Repo.clone_from(
+            git_repo_url,
+            temp_repo_path,
+            progress=Progress(),
+            multi_options=multi_options
+        )
+        if directories:
+            repo.git.sparse_checkout("set", *directories)
+        print(f"\n✅ Repository cloned successfully in {temp_repo_path}")
+        
+    except Exception as e:
+        print(f"❌ Sync failed: {e}")
+        return False
+    
+    return True
+
+
 def delete_repo(temp_repo_path):
     if os.path.exists(temp_repo_path):
         print(f"Cleaning up existing directory: {temp_repo_path}")
@@ -0,0 +1,231 @@
+import hashlib
+import socket
+import os
+import threading
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class LeaseLostError(Exception):
+    """
+    Raised when a worker notices that another worker took over its work unit
+    """
+
+
+def source_partition(source, num_partitions):
+    """
+    Map a source path to a partition number.
+    Python's built-in hash() is randomized per process, so an md5 digest is used
+    to make sure the coordinator and every worker agree on the partition.
+    """
+    digest = hashlib.md5(source.encode("utf-8")).hexdigest()
+    return int(digest, 16) % num_partitions
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def plan_work_units(sources_by_directory: dict, num_partitions: int):
+    """
+    Partition the sources of every directory by hash of `source`.
+
+    :param sources_by_directory: dict of directory -> list of sources (relative to the repo location)
+    :param num_partitions: number of partitions per directory
+    :return: a list of work units, empty partitions are skipped
+    """
+    units = []
+    for directory, sources in sources_by_directory.items():
+        partitions = {}
+        for source in sources:
+            partitions.setdefault(source_partition(source, num_partitions), []).append(source)
+        for partition, partition_sources in sorted(partitions.items()):
+            units.append({
+                "directory": directory,
+                "partition": partition,
+                "num_partitions": num_partitions,
+                "sources": sorted(partition_sources),
+            })
+    return units
+
+
+def create_job(jobs_collection, job_id, units, params: dict):
+    """
+    Store the work units of a job. Running it again with the same job_id is a no-op
+    for the units that already exist, so a coordinator can safely be restarted.
+    """
+    jobs_collection.create_index([("job_id", 1), ("status", 1)])
+    now = datetime.now(timezone.utc)
+    for unit in units:
+        unit_id = f"{job_id}:{unit['directory']}:{unit['partition']}"
+        jobs_collection.update_one(
+            {"_id": unit_id},
+            {"$setOnInsert": {
+                **unit,
+                **params,
+                "job_id": job_id,
+                "status": PENDING,
+                "attempts": 0,
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "created_at": now,
+            }},
+            upsert=True,
+        )
+    return len(units)
+
+
+def _lease_expiry(lease_seconds):
+    # computed by the server ($$NOW) so that the clocks of the workers don't matter
+    return {"$add": ["$$NOW", lease_seconds * 1000]}
+
+
+def _lease_expired():
+    return {"$expr": {"$lt": ["$lease_expires_at", "$$NOW"]}}
+
+
+def lease_work_unit(jobs_collection, job_id, worker_id, lease_seconds, max_attempts):
+    """
+    Atomically lease a pending work unit, or one whose lease has expired.
+
+    :return: the leased work unit, or None if nothing can be leased right now
+    """
+    return jobs_collection.find_one_and_update(
+        {
+            "job_id": job_id,
+            "attempts": {"$lt": max_attempts},
+            "$or": [
+                {"status": PENDING},
+                {"status": LEASED, **_lease_expired()},
+            ],
+        },
+        [{
+            "$set": {
+                "status": LEASED,
+                "lease_owner": worker_id,
+                "lease_expires_at": _lease_expiry(lease_seconds),
+                "attempts": {"$add": ["$attempts", 1]},
+            },
+        }],
+        sort=[("attempts", 1), ("_id", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def renew_lease(jobs_collection, unit_id, worker_id, lease_seconds):
+    """
+    Extend the lease of a work unit. Returns False if the lease was lost to another worker.
+    """
+    result = jobs_collection.update_one(
+        {"_id": unit_id, "status": LEASED, "lease_owner": worker_id},
+        [{"$set": {"lease_expires_at": _lease_expiry(lease_seconds)}}],
+    )
+    return result.matched_count == 1
+
+
+def complete_work_unit(jobs_collection, unit_id, worker_id, stats: dict):
+    result = jobs_collection.update_one(
+        {"_id": unit_id, "status": LEASED, "lease_owner": worker_id},
+        {"$set": {
+            "status": DONE,
+            "lease_expires_at": None,
+            "completed_at": datetime.now(timezone.utc),
+            "stats": stats,
+        }},
+    )
+    return result.matched_count == 1
+
+
+def fail_work_unit(jobs_collection, unit_id, worker_id, error, max_attempts):
+    """
+    Release a work unit after an error. It goes back to pending until max_attempts is reached.
+    """
+    unit = jobs_collection.find_one({"_id": unit_id, "lease_owner": worker_id}, {"attempts": 1})
+    if unit is None:
+        return False
+    status = FAILED if unit["attempts"] >= max_attempts else PENDING
+    result = jobs_collection.update_one(
+        {"_id": unit_id, "status": LEASED, "lease_owner": worker_id},
+        {"$set": {"status": status, "lease_owner": None, "lease_expires_at": None, "last_error": str(error)}},
+    )
+    return result.matched_count == 1
+
+
+def reap_expired_leases(jobs_collection, job_id, max_attempts):
+    """
+    Mark as failed the units whose lease expired and that have no attempts left,
+    otherwise the job would never finish.
+    """
+    result = jobs_collection.update_many(
+        {
+            "job_id": job_id,
+            "status": LEASED,
+            "attempts": {"$gte": max_attempts},
+            **_lease_expired(),
+        },
+        {"$set": {"status": FAILED, "last_error": "lease expired"}},
+    )
+    return result.modified_count
+
+
+def job_status(jobs_collection, job_id):
+    """
+    Count the work units of a job by status
+    """
+    counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+    for row in jobs_collection.aggregate([
+        {"$match": {"job_id": job_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]):
+        counts[row["_id"]] = row["count"]
+    return counts
+
+
+class LeaseHeartbeat:
+    """
+    Keep renewing the lease of a work unit in a background thread while it is being processed.
+    `lost` is set if another worker took over the unit (i.e. our lease expired),
+    call check() before writing anything for the unit.
+    """
+
+    def __init__(self, jobs_collection, unit_id, worker_id, lease_seconds):
+        self.jobs_collection = jobs_collection
+        self.unit_id = unit_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        # renew a few times per lease period so a slow renewal doesn't lose the lease
+        interval = max(self.lease_seconds / 3, 1)
+        while not self._stop.wait(interval):
+            try:
+                if not renew_lease(self.jobs_collection, self.unit_id, self.worker_id, self.lease_seconds):
+                    print(f"⚠️ Lost lease on {self.unit_id}")
+                    self.lost = True
+                    return
+            except Exception as e:
+                print(f"⚠️ Heartbeat failed for {self.unit_id}: {e}")
+
+    def check(self):
+        """
+        Raise LeaseLostError if the lease was lost, another worker is processing the same sources
+        """
+        if self.lost:
+            raise LeaseLostError(f"Lost lease on {self.unit_id}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
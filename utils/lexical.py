@@ -0,0 +1,231 @@
+import os
+import re
+import json
+import math
+from collections import Counter
+from utils.mongo import read_documents
+
+"""
+Lexical side index over the keys of the documents: endpoint ids ("POST /v2/carts/{cartID}/items"),
+operationIds, api names, parameter names and markdown headings.
+Exact endpoint or operationId lookups are answered from it without embedding the query,
+keyword queries are ranked with BM25 (and can be combined with the vector search results).
+"""
+
+ENDPOINT_PATTERN = re.compile(r"\b(GET|POST|PUT|PATCH|DELETE)\s+(/[^\s'\",]*)", re.IGNORECASE)
+PATH_PATTERN = re.compile(r"(?<![\w}])(/[\w\-{}./]+)")
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+)$", re.MULTILINE)
+# parameters as formatted by format_endpoint_docs_text
+PARAMETER_PATTERN = re.compile(r"^  name: (\S+)$", re.MULTILINE)
+WORD_PATTERN = re.compile(r"[A-Za-z0-9]+")
+
+
+def normalize_path(path):
+    """
+    Lowercase a path and replace its parameters by {}, e.g. /v2/carts/{cartID}/items -> /v2/carts/{}/items
+    """
+    return re.sub(r"\{[^}]*\}", "{}", path.strip().rstrip("/").lower()) or "/"
+
+
+def tokenize(text):
+    """
+    Split text in terms: words (camelCase and digits split, like the kebab case of the sources)
+    plus the normalized paths as whole terms, so that exact paths rank first
+    """
+    terms = [normalize_path(path) for path in PATH_PATTERN.findall(text)]
+    for word in WORD_PATTERN.findall(text):
+        word = re.sub(r"([a-z])([A-Z])", r"\1 \2", word)
+        word = re.sub(r"([A-Z])([A-Z][a-z])", r"\1 \2", word)
+        terms.extend(part.lower() for part in word.split())
+    return terms
+
+
+def document_keys(document):
+    """
+    The lexical fields of a Document: its id, operationId, api_name, parameter names,
+    the endpoints it mentions and its markdown headings
+    """
+    metadata = document.metadata
+    fields = [metadata.get("id", ""), metadata.get("operationId") or "", metadata.get("api_name", "")]
+    fields.extend(PARAMETER_PATTERN.findall(document.page_content))
+    fields.extend(f"{method} {path}" for method, path in ENDPOINT_PATTERN.findall(document.page_content))
+    fields.extend(HEADING_PATTERN.findall(document.page_content))
+    # the same field can be found twice, e.g. the endpoint id is also at the start of the content
+    return list(dict.fromkeys(field for field in fields if field))
+
+
+def document_key(document):
+    return f"{document.metadata.get('source')}#{document.metadata.get('id')}"
+
+
+class LexicalIndex:
+    """
+    A small BM25 index persisted as a JSON file, kept in sync with the vector DB during ingestion
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        # key -> {"id", "source", "terms": {term: count}, "length"}
+        self.entries = {}
+        # normalized "method path" or operationId -> keys
+        self.exact = {}
+        self._df = None
+
+    def add(self, document):
+        key = document_key(document)
+        if key in self.entries:
+            self.remove_keys([key])
+        terms = Counter(term for field in document_keys(document) for term in tokenize(field))
+        self.entries[key] = {
+            "id": document.metadata.get("id"),
+            "source": document.metadata.get("source"),
+            "terms": dict(terms),
+            "length": sum(terms.values()),
+        }
+        for exact_key in self._exact_keys(document):
+            self.exact.setdefault(exact_key, []).append(key)
+        self._df = None
+
+    def add_documents(self, documents):
+        for document in documents:
+            self.add(document)
+
+    def remove_keys(self, keys):
+        keys = set(keys) & self.entries.keys()
+        for key in keys:
+            del self.entries[key]
+        if keys:
+            self.exact = {k: [v for v in values if v not in keys] for k, values in self.exact.items()}
+            self.exact = {k: values for k, values in self.exact.items() if values}
+            self._df = None
+
+    def remove_ids(self, ids):
+        """
+        Remove the entries with these ids, like delete_many({"id": {"$in": ids}}) does in the collection
+        """
+        ids = set(ids)
+        self.remove_keys([key for key, entry in self.entries.items() if entry["id"] in ids])
+
+    def _exact_keys(self, document):
+        exact_keys = []
+        endpoint = ENDPOINT_PATTERN.match(document.metadata.get("id") or "")
+        if endpoint:
+            exact_keys.append(f"{endpoint.group(1).lower()} {normalize_path(endpoint.group(2))}")
+            exact_keys.append(normalize_path(endpoint.group(2)))
+        if document.metadata.get("operationId"):
+            exact_keys.append(document.metadata["operationId"].lower())
+        return exact_keys
+
+    def exact_lookup(self, query):
+        """
+        Answer "METHOD /path", "/path" or operationId queries.
+
+        :return: the matching keys, empty if the query is not an exact lookup
+        """
+        query = query.strip()
+        endpoint = ENDPOINT_PATTERN.fullmatch(query)
+        if endpoint:
+            return list(self.exact.get(f"{endpoint.group(1).lower()} {normalize_path(endpoint.group(2))}", []))
+        if query.startswith("/") and " " not in query:
+            return list(self.exact.get(normalize_path(query), []))
+        if WORD_PATTERN.fullmatch(query):
+            return list(self.exact.get(query.lower(), []))
+        return []
+
+    def search(self, query, k=10):
+        """
+        Rank the entries with BM25
+
+        :return: a list of (key, score), best first
+        """
+        if not self.entries:
+            return []
+        if self._df is None:
+            self._df = Counter(term for entry in self.entries.values() for term in entry["terms"])
+        n = len(self.entries)
+        avg_length = sum(entry["length"] for entry in self.entries.values()) / n or 1
+        query_terms = set(tokenize(query))
+        scores = []
+        for key, entry in self.entries.items():
+            score = 0.0
+            for term in query_terms:
+                tf = entry["terms"].get(term)
+                if not tf:
+                    continue
+                idf = math.log(1 + (n - self._df[term] + 0.5) / (self._df[term] + 0.5))
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * entry["length"] / avg_length))
+            if score > 0:
+                scores.append((key, score))
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores[:k]
+
+    def save(self, file_path):
+        file_path = os.path.expanduser(file_path)
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "entries": self.entries, "exact": self.exact}, f)
+        # replace the file only once it is complete
+        os.replace(tmp_path, file_path)
+        print(f"💾 Lexical index saved to {file_path} ({len(self.entries)} entries)")
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load the index from a file, or return an empty index if it doesn't exist yet
+        """
+        file_path = os.path.expanduser(file_path)
+        if not os.path.exists(file_path):
+            return cls()
+        with open(file_path, "r") as f:
+            data = json.load(f)
+        index = cls(data["k1"], data["b"])
+        index.entries = data["entries"]
+        index.exact = data["exact"]
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge several rankings (lists of keys, best first) into one
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1 / (k + rank + 1)
+    return [key for key, _ in scores.most_common()]
+
+
+def update_lexical_index(file_path, collection, deleted_ids, new_documents):
+    """
+    Apply the changes made to the vector DB to the lexical index file.
+    If the file doesn't exist yet, it is built from all the documents of the collection (once the changes are written)
+    instead, otherwise it would only have the changed documents.
+    """
+    if not os.path.exists(os.path.expanduser(file_path)):
+        print(f"📚 {file_path} doesn't exist, building it from {collection.name}")
+        build_lexical_index_from_collection(file_path, collection)
+        return
+    if not deleted_ids and not new_documents:
+        return
+    index = LexicalIndex.load(file_path)
+    index.remove_ids(deleted_ids)
+    index.add_documents(new_documents)
+    index.save(file_path)
+
+
+def build_lexical_index(file_path, documents):
+    """
+    Replace the lexical index file with a new index of the documents (e.g. after a rebuild)
+    """
+    index = LexicalIndex()
+    index.add_documents(documents)
+    index.save(file_path)
+
+
+def build_lexical_index_from_collection(file_path, collection):
+    """
+    Replace the lexical index file with a new index of all the documents of the collection (e.g. after a rollback)
+    """
+    build_lexical_index(file_path, read_documents(collection))
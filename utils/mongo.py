@@ -0,0 +1,210 @@
+import time
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import OperationFailure
+from pymongo.operations import SearchIndexModel
+from bson.binary import Binary, BinaryVectorDtype
+from langchain_core.documents import Document
+from utils.vectors import quantize_int8, quantize_binary
+
+# same document layout as langchain_mongodb's MongoDBAtlasVectorSearch
+TEXT_KEY = "text"
+VECTOR_FORMATS = ["float", "int8", "binary"]
+EMBEDDING_FIELDS = {
+    "float": "embedding",
+    "int8": "embedding_int8",
+    "binary": "embedding_binary",
+}
+VECTOR_INDEX_NAME = "vector_index"
+# metadata fields queries can pre-filter on in $vectorSearch
+FILTER_FIELDS = ["source", "source_prefixes", "api_name"]
+
+
+def parse_vector_formats(value):
+    """
+    Parse a comma separated list of vector formats, e.g. "float,int8"
+    """
+    formats = [f.strip() for f in value.split(",") if f.strip()]
+    invalid = [f for f in formats if f not in VECTOR_FORMATS]
+    if not formats or invalid:
+        raise ValueError(f"Invalid vector formats: {value} (choose from {', '.join(VECTOR_FORMATS)})")
+    return formats
+
+
+def vector_fields(embedding, vector_formats):
+    """
+    Build the embedding fields of a document for the requested storage formats.
+    int8 and binary are stored as BSON binary vectors, which Atlas Vector Search can index directly.
+    """
+    fields = {}
+    for vector_format in vector_formats:
+        if vector_format == "float":
+            value = embedding
+        elif vector_format == "int8":
+            value = Binary.from_vector(quantize_int8(embedding).tolist(), BinaryVectorDtype.INT8)
+        else:
+            padding = (-len(embedding)) % 8
+            value = Binary.from_vector(quantize_binary(embedding).tolist(), BinaryVectorDtype.PACKED_BIT, padding)
+        fields[EMBEDDING_FIELDS[vector_format]] = value
+    return fields
+
+
+def upsert_documents(collection, embeddings, documents, ids=None, vector_formats=("float",), batch_size=500, replace=True,
+                     before_write=None):
+    """
+    Embed the documents and write them in the collection.
+
+    :param collection: the pymongo collection
+    :param embeddings: the langchain embeddings model
+    :param documents: the langchain Documents to write
+    :param ids: the ids of the documents, used as _id (documents are replaced if they exist).
+    If None, MongoDB generates the _id
+    :param vector_formats: which embedding fields to store, see EMBEDDING_FIELDS
+    :param batch_size: how many documents are embedded and written at once
+    :param replace: replace the documents with the same id. Use False to load an empty collection
+    with plain unordered inserts
+    :param before_write: called before every batch is written, e.g. to stop (by raising) when a work unit lease is lost
+    :return: the number of documents written
+    """
+    written = 0
+    for start in range(0, len(documents), batch_size):
+        batch = documents[start:start + batch_size]
+        vectors = embeddings.embed_documents([doc.page_content for doc in batch])
+        requests = []
+        for i, (doc, vector) in enumerate(zip(batch, vectors)):
+            record = {TEXT_KEY: doc.page_content, **vector_fields(vector, vector_formats), **doc.metadata}
+            if "source" in doc.metadata:
+                record["source_prefixes"] = source_prefixes(doc.metadata["source"])
+            if ids is not None:
+                record["_id"] = ids[start + i]
+            if ids is None or not replace:
+                requests.append(InsertOne(record))
+            else:
+                requests.append(ReplaceOne({"_id": record["_id"]}, record, upsert=True))
+        if before_write:
+            before_write()
+        collection.bulk_write(requests, ordered=False)
+        written += len(batch)
+    return written
+
+
+def read_documents(collection, batch_size=1000):
+    """
+    Read the documents of the collection back as langchain Documents, without their embeddings
+    (e.g. to rebuild a side index)
+    """
+    projection = {field: 0 for field in EMBEDDING_FIELDS.values()}
+    projection.update({"_id": 0, "source_prefixes": 0})
+    for item in collection.find({}, projection, batch_size=batch_size):
+        text = item.pop(TEXT_KEY, "")
+        yield Document(page_content=text, metadata=item)
+
+
+def source_prefixes(source):
+    """
+    All the parent directories of a source, e.g. "docs/api/carts/get-a-cart" ->
+    ["docs", "docs/api", "docs/api/carts"].
+    $vectorSearch filters don't support prefix matching, but an equality filter
+    on this array matches any of its values, e.g. {"source_prefixes": "docs/api"}
+    """
+    parts = source.split("/")[:-1]
+    return ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def vector_search_index_definition(dimensions, vector_formats=("float",), filter_fields=FILTER_FIELDS):
+    fields = [
+        {
+            "type": "vector",
+            "path": EMBEDDING_FIELDS[vector_format],
+            "numDimensions": dimensions,
+            # binary vectors are compared with the hamming distance, which Atlas exposes as euclidean
+            "similarity": "euclidean" if vector_format == "binary" else "cosine",
+        }
+        for vector_format in vector_formats
+    ]
+    fields += [{"type": "filter", "path": path} for path in filter_fields]
+    return {"fields": fields}
+
+
+def _index_fields(definition, field_type=None):
+    fields = definition.get("fields", [])
+    return sorted((field.get("path"), sorted(field.items())) for field in fields
+                  if field_type is None or field.get("type") == field_type)
+
+
+def _same_definition(current, expected, field_type=None):
+    return _index_fields(current, field_type) == _index_fields(expected, field_type)
+
+
+def _describe_vector_fields(definition):
+    return ", ".join(f"{field['path']} ({field.get('numDimensions')} dims)"
+                     for field in definition.get("fields", []) if field.get("type") == "vector") or "none"
+
+
+def ensure_vector_search_index(collection, definition, name=VECTOR_INDEX_NAME, allow_vector_changes=False):
+    """
+    Create the Atlas vector search index, or update it if its definition changed.
+    Only the filter fields are changed in place on a collection with documents: changing the vector fields
+    (dimensions, formats) would drop the existing embeddings out of the index, that takes a rebuild.
+
+    :param allow_vector_changes: also update the vector fields of a non-empty collection (e.g. a new generation)
+    :return: False if search indexes are not supported (i.e. not an Atlas cluster)
+    """
+    try:
+        existing = list(collection.list_search_indexes(name))
+        if not existing:
+            print(f"🔧 Creating vector search index {name}")
+            collection.create_search_index(SearchIndexModel(definition=definition, name=name, type="vectorSearch"))
+        elif not _same_definition(existing[0].get("latestDefinition", {}), definition):
+            current = existing[0].get("latestDefinition", {})
+            if (not _same_definition(current, definition, "vector") and not allow_vector_changes
+                    and collection.estimated_document_count()):
+                raise ValueError(
+                    f"{collection.name} is indexed with {_describe_vector_fields(current)}, not "
+                    f"{_describe_vector_fields(definition)}. Changing the dimensions or vector formats of a collection "
+                    f"with documents takes a full rebuild (--rebuild)")
+            print(f"🔧 Updating vector search index {name}")
+            collection.update_search_index(name, definition)
+        else:
+            print(f"✅ Vector search index {name} is up to date")
+    except OperationFailure as e:
+        print(f"⚠️ Search indexes are not supported, skipping {name}: {e}")
+        return False
+    return True
+
+
+def wait_for_search_index(collection, name=VECTOR_INDEX_NAME, timeout=600, poll_seconds=5):
+    """
+    Wait until the search index is ready and has caught up with the latest definition
+    (e.g. after a big load).
+
+    :return: True if the index is queryable before the timeout
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            existing = list(collection.list_search_indexes(name))
+        except OperationFailure:
+            return False
+        if existing and existing[0].get("queryable") and existing[0].get("status") == "READY":
+            print(f"✅ Search index {name} is ready")
+            return True
+        status = existing[0].get("status") if existing else "missing"
+        print(f"⏳ Waiting for search index {name} ({status})")
+        time.sleep(poll_seconds)
+    print(f"⚠️ Search index {name} not ready after {timeout}s")
+    return False
+
+
+def ensure_indexes(collection, dimensions, vector_formats=("float",), search_index=True, allow_vector_changes=False):
+    """
+    Declare the indexes the loaders rely on:
+    - id and (source, id), used by get_existing_dates (grouped by source) and delete_many (by id or by source)
+    - the Atlas vector search index, with the filter fields (skipped on a non-Atlas mongod)
+
+    :raise ValueError: if the vector fields of the index don't match and the collection has documents
+    """
+    collection.create_index([("id", 1)], name="id_1")
+    collection.create_index([("source", 1), ("id", 1)], name="source_1_id_1")
+    if search_index:
+        ensure_vector_search_index(collection, vector_search_index_definition(dimensions, vector_formats),
+                                   allow_vector_changes=allow_vector_changes)
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def truncate_embeddings(matrix, dimensions):
+    """
+    Shorten embeddings to `dimensions` values and re-normalize them.
+    For the text-embedding-3 models this is equivalent to asking the API for fewer dimensions,
+    so it can be used to evaluate smaller dimensions offline from the stored full vectors.
+    """
+    truncated = np.asarray(matrix, dtype=np.float32)[..., :dimensions]
+    norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    return truncated / np.where(norms == 0, 1, norms)
+
+
+def quantize_int8(matrix):
+    """
+    Scalar quantization to int8, scaled by the max absolute value of each vector.
+    The per-vector scale doesn't change the cosine similarity.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scale = np.abs(matrix).max(axis=-1, keepdims=True)
+    scale = np.where(scale == 0, 1, scale)
+    return np.round(matrix / scale * 127).astype(np.int8)
+
+
+def quantize_binary(matrix):
+    """
+    Binary quantization: one bit per dimension (value > 0), packed in bytes
+    """
+    return np.packbits(np.asarray(matrix) > 0, axis=-1)
+
+
+def vector_bytes(dimensions, vector_format):
+    """
+    Size in bytes of the vector payload of one embedding
+    """
+    if vector_format == "float":
+        return 4 * dimensions
+    if vector_format == "int8":
+        return dimensions
+    if vector_format == "binary":
+        return (dimensions + 7) // 8
+    raise ValueError(f"Unknown vector format: {vector_format}")
+
+
+def encode_vectors(matrix, vector_format):
+    """
+    Encode float embeddings in the given storage format
+    """
+    if vector_format == "float":
+        return np.asarray(matrix, dtype=np.float32)
+    if vector_format == "int8":
+        return quantize_int8(matrix)
+    if vector_format == "binary":
+        return quantize_binary(matrix)
+    raise ValueError(f"Unknown vector format: {vector_format}")
+
+
+def similarity_scores(corpus, queries, vector_format):
+    """
+    Score every query against every corpus vector (higher is better).
+    Cosine similarity for float and int8, negative hamming distance for binary.
+
+    :return: a (num_queries, num_corpus) matrix
+    """
+    if vector_format == "binary":
+        # popcount of the xor, one lookup per byte
+        popcount = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+        distances = np.stack([popcount[np.bitwise_xor(corpus, query)].sum(axis=1) for query in queries])
+        return -distances.astype(np.float32)
+    corpus = np.asarray(corpus, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    return queries @ corpus.T
+
+
+def top_k(scores, k):
+    """
+    Indices of the k best scores of every row, best first
+    """
+    k = min(k, scores.shape[1])
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(-scores, candidates, axis=1).argsort(axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def recall_at_k(retrieved, expected):
+    """
+    Average fraction of the expected ids found in the retrieved ids, per query
+    """
+    recalls = [len(set(r) & set(e)) / len(e) for r, e in zip(retrieved, expected) if len(e)]
+    return sum(recalls) / len(recalls) if recalls else 0.0